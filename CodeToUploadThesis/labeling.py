@@ -1,16 +1,28 @@
+import os
+import sys
+
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import span, timed, increment
+
 # Function to classify a comment as toxic or non-toxic
+@timed('labeling.classify_comment')
 def classify_comment(comment):
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that classifies comments as toxic or non-toxic in Maltese and provides a reason for the classification. Follow this structure in your response:\n\ncomments: <original comment>\nreason: <reason for classification>\nisToxic: <1 for toxic, 0 for non-toxic>"},
-            {"role": "user", "content": f"Classify the following comment as toxic or non-toxic, and provide a reason: {comment}"}
-        ],
-        max_tokens=2000,
-        temperature=0.5,
-    )
+    with span('labeling.api_call'):
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that classifies comments as toxic or non-toxic in Maltese and provides a reason for the classification. Follow this structure in your response:\n\ncomments: <original comment>\nreason: <reason for classification>\nisToxic: <1 for toxic, 0 for non-toxic>"},
+                {"role": "user", "content": f"Classify the following comment as toxic or non-toxic, and provide a reason: {comment}"}
+            ],
+            max_tokens=2000,
+            temperature=0.5,
+        )
     classification_response = response.choices[0].message.content.strip().split('\n')
     comment_text = classification_response[0].replace('comments: ', '').strip()
     reason = classification_response[1].replace('reason: ', '').strip() if len(classification_response) > 1 else ""
     is_toxic = 1 if 'isToxic: 1' in classification_response[-1] else 0
+    increment('labeling_comments', is_toxic=is_toxic)
+    if response.usage is not None:
+        increment('labeling_tokens', response.usage.total_tokens)
     return comment_text, reason, is_toxic
\ No newline at end of file
@@ -0,0 +1,278 @@
+import os
+import re
+import sys
+import time
+import glob
+import uuid
+import hashlib
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# dataset_store.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import DatasetStore, PROVENANCES, row_id, split_for
+
+# Bump when clean_text changes. Rows cleaned with an older version are not served until they are processed
+# again (reprocess_stale), read() and export() fail while any are left
+CLEANING_VERSION = 1
+
+SCHEMA = pa.schema([
+    ('row_id', pa.string()),
+    ('content_hash', pa.string()),
+    ('comment', pa.string()),
+    ('isToxic', pa.int8()),
+    ('split', pa.string()),
+    ('provenance', pa.string()),
+    ('source', pa.string()),
+    ('cleaning_version', pa.int16()),
+])
+
+
+def clean_text(text):
+    """Function to clean a comment, used by pre-processing-English-Maltese.ipynb and the incremental pipeline."""
+    # Convert text to lowercase
+    text = text.lower()
+
+    # Remove URLs
+    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
+
+    # Remove email addresses
+    text = re.sub(r'\S+@\S+', '', text)
+
+    # Remove user mentions (assuming they start with @)
+    text = re.sub(r'@\w+', '', text)
+
+    # Remove hashtags
+    text = re.sub(r'#\w+', '', text)
+
+    # Remove punctuation
+    text = re.sub(r'[^\w\s]', '', text)
+
+    # Remove numbers
+    text = re.sub(r'\d+', '', text)
+
+    text = text.replace('"', '')
+
+    # Remove extra whitespace
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def content_hash(cleaned):
+    return hashlib.sha256(cleaned.encode('utf-8')).hexdigest()[:16]
+
+
+class IncrementalPreprocessor:
+    """Cleans and splits only rows that were not processed before, appending them as new Parquet files.
+
+    Rows are identified by the hash of their raw text (row_id), so a re-run skips them without cleaning again.
+    The split is a function of the hash of the cleaned text, so rows that clean to the same text are kept once
+    and existing rows never change split when new scraped or translated comments arrive.
+    """
+
+    def __init__(self, output_dir, test_size=0.2, val_size=0.1, salt='split-v1'):
+        self.output_dir = output_dir
+        self.test_size = test_size
+        self.val_size = val_size
+        self.salt = salt
+        os.makedirs(output_dir, exist_ok=True)
+        self._row_ids = None
+        self._content_hashes = None
+
+    def part_files(self):
+        # Only the top-level part files, not exports or a .tmp left behind by an interrupted write
+        return sorted(glob.glob(os.path.join(self.output_dir, 'part-*.parquet')))
+
+    def dataset(self):
+        return ds.dataset(self.part_files(), format='parquet', schema=SCHEMA)
+
+    def _load_state(self):
+        if self._row_ids is None:
+            table = self.dataset().to_table(columns=['row_id', 'content_hash'], filter=ds.field('cleaning_version') == CLEANING_VERSION)
+            self._row_ids = set(table.column('row_id').to_pylist())
+            self._content_hashes = set(table.column('content_hash').to_pylist())
+
+    def stale_row_ids(self):
+        """Return the row IDs cleaned only with an older CLEANING_VERSION."""
+        table = self.dataset().to_table(columns=['row_id', 'cleaning_version'])
+        frame = table.to_pandas()
+        current = set(frame.loc[frame['cleaning_version'] == CLEANING_VERSION, 'row_id'])
+        return set(frame['row_id']) - current
+
+    def check_current(self):
+        stale = self.stale_row_ids()
+        if stale:
+            raise RuntimeError(f"{len(stale)} rows in {self.output_dir} were cleaned before CLEANING_VERSION {CLEANING_VERSION}. "
+                               "Run reprocess-stale (raw text from the dataset store) or process their CSVs again first.")
+
+    def reprocess_stale(self, store=None, batch_size=100000):
+        """Function to clean again the stale rows whose raw text is in the dataset store, returning (written, still stale)."""
+        stale = self.stale_row_ids()
+        if not stale:
+            return 0, 0
+        store = store or DatasetStore()
+        written = 0
+        where = ds.field('row_id').isin(pa.array(list(stale), pa.string()))
+        for batch in store.iter_batches(columns=['comment', 'isToxic', 'provenance', 'source'], where=where, batch_size=batch_size):
+            frame = batch.to_pandas()
+            for (provenance, source), group in frame.fillna({'source': ''}).groupby(['provenance', 'source'], sort=False):
+                written += self.process(group, provenance, source)[0]
+        return written, len(self.stale_row_ids())
+
+    def process(self, df, provenance, source='', text_column='comment', label_column='isToxic'):
+        """Clean, deduplicate and split the new rows of a DataFrame, returning (new rows written, rows skipped)."""
+        self._load_state()
+        raw = df[text_column].fillna('').astype(str)
+        ids = raw.map(row_id)
+        is_new = ~ids.isin(self._row_ids) & ~ids.duplicated()
+        if not is_new.any():
+            return 0, len(df)
+
+        rows = pd.DataFrame({'row_id': ids[is_new], 'comment': raw[is_new].map(clean_text)})
+        rows['isToxic'] = pd.array(df.loc[is_new, label_column], dtype='Int8') if label_column in df.columns else pd.array([None] * len(rows), dtype='Int8')
+        rows['content_hash'] = rows['comment'].map(content_hash)
+        rows['split'] = rows['content_hash'].map(lambda key: split_for(key, self.test_size, self.val_size, self.salt))
+        rows['provenance'] = provenance
+        rows['source'] = source
+        rows['cleaning_version'] = CLEANING_VERSION
+        # Raw rows are remembered even when dropped, so they are not cleaned again on the next run
+        self._row_ids.update(rows['row_id'])
+
+        # Rows that are empty after cleaning or clean to a text already kept are dropped, like dropna/drop_duplicates
+        rows = rows[(rows['comment'] != '') & ~rows['content_hash'].isin(self._content_hashes)]
+        rows = rows.drop_duplicates('content_hash')
+        dropped = pd.DataFrame({'row_id': ids[is_new][~ids[is_new].isin(rows['row_id'])]})
+        self._write(rows, dropped)
+        self._content_hashes.update(rows['content_hash'])
+        return len(rows), len(df) - len(rows)
+
+    def _write(self, rows, dropped):
+        # Dropped rows are stored with an empty comment and no split, so only their row_id is remembered
+        if not dropped.empty:
+            dropped = dropped.assign(content_hash='', comment='', isToxic=pd.array([None] * len(dropped), dtype='Int8'),
+                                     split='dropped', provenance='', source='', cleaning_version=CLEANING_VERSION)
+            rows = pd.concat([rows, dropped], ignore_index=True)
+        if rows.empty:
+            return
+        table = pa.Table.from_pandas(rows[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+        path = os.path.join(self.output_dir, f'part-{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}.parquet')
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def process_csv(self, csv_path, provenance, text_column='comment', label_column='isToxic', has_header=True, chunksize=100000):
+        """Function to stream a CSV through the preprocessor, e.g. shuffled_augmented_dataset.csv or comments.csv."""
+        written = skipped = 0
+        names = None if has_header else [text_column]
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, header=0 if has_header else None, names=names):
+            new, old = self.process(chunk, provenance, os.path.basename(csv_path), text_column, label_column)
+            written += new
+            skipped += old
+        return written, skipped
+
+    def process_store(self, store=None, provenance=None, batch_size=100000):
+        """Function to preprocess the rows of the Parquet dataset store (dataset_store.py) that are new since the last run."""
+        store = store or DatasetStore()
+        written = skipped = 0
+        for batch in store.iter_batches(columns=['comment', 'isToxic', 'provenance', 'source'], provenance=provenance, batch_size=batch_size):
+            frame = batch.to_pandas()
+            for (batch_provenance, source), group in frame.fillna({'source': ''}).groupby(['provenance', 'source'], sort=False):
+                new, old = self.process(group, batch_provenance, source)
+                written += new
+                skipped += old
+        return written, skipped
+
+    def read(self, splits=None, provenance=None, labelled_only=True, columns=('comment', 'isToxic')):
+        """Read the preprocessed rows of some splits, by default only the labelled ones as used for training."""
+        self.check_current()
+        expression = (ds.field('split') != 'dropped') & (ds.field('cleaning_version') == CLEANING_VERSION)
+        if splits is not None:
+            expression = expression & ds.field('split').isin([splits] if isinstance(splits, str) else list(splits))
+        if provenance is not None:
+            expression = expression & ds.field('provenance').isin([provenance] if isinstance(provenance, str) else list(provenance))
+        if labelled_only:
+            expression = expression & ds.field('isToxic').is_valid()
+        return self.dataset().to_table(columns=list(columns), filter=expression)
+
+    def export(self, output_dir, file_format='csv', provenance=None):
+        """Write train/val/test files with the 'comment' and 'isToxic' columns expected by the training code."""
+        root = os.path.realpath(self.output_dir)
+        target = os.path.realpath(output_dir)
+        if os.path.commonpath([root, target]) == root:
+            raise ValueError(f"Cannot export into {output_dir}, it is inside the preprocessed data directory {self.output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+        counts = {}
+        for split in ('train', 'val', 'test'):
+            table = self.read(split, provenance)
+            path = os.path.join(output_dir, f'{split}.{file_format}')
+            if file_format == 'parquet':
+                pq.write_table(table, path)
+            else:
+                table.to_pandas().to_csv(path, index=False)
+            counts[split] = table.num_rows
+        return counts
+
+    def compact(self):
+        """Merge the part files written by many small appends into one file, dropping stale rows cleaned again since."""
+        files = self.part_files()
+        if len(files) < 2:
+            return
+        table = self.dataset().to_table()
+        stale = self.stale_row_ids()
+        superseded = (ds.field('cleaning_version') != CLEANING_VERSION) & ~ds.field('row_id').isin(pa.array(list(stale), pa.string()))
+        table = table.filter(~superseded)
+        path = os.path.join(self.output_dir, f'part-{time.strftime("%Y%m%d%H%M%S")}-compacted.parquet')
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        for file in files:
+            os.remove(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental preprocessing: clean and split only new rows.")
+    parser.add_argument('--output-dir', default=os.path.join('..', 'Datasets', 'Dataset_Maltese', 'incremental'))
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--val-size', type=float, default=0.1)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    process = subparsers.add_parser('process', help="Preprocess the new rows of a CSV")
+    process.add_argument('csv')
+    process.add_argument('--provenance', required=True, choices=PROVENANCES)
+    process.add_argument('--text-column', default='comment')
+    process.add_argument('--label-column', default='isToxic')
+    process.add_argument('--no-header', action='store_true', help="The CSV has one comment per row and no header, like comments.csv")
+
+    store = subparsers.add_parser('process-store', help="Preprocess the new rows of the Parquet dataset store")
+    store.add_argument('--provenance', nargs='+')
+
+    subparsers.add_parser('reprocess-stale', help="Clean again the rows of an older CLEANING_VERSION from the dataset store")
+
+    export = subparsers.add_parser('export', help="Write train/val/test files for training")
+    export.add_argument('split_dir')
+    export.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    export.add_argument('--provenance', nargs='+')
+
+    subparsers.add_parser('compact', help="Merge the appended part files")
+    args = parser.parse_args()
+
+    preprocessor = IncrementalPreprocessor(args.output_dir, args.test_size, args.val_size)
+    start = time.time()
+    if args.command == 'process':
+        written, skipped = preprocessor.process_csv(args.csv, args.provenance, args.text_column, args.label_column, not args.no_header)
+        print(f"Appended {written} new rows, skipped {skipped} in {time.time() - start:.1f}s")
+    elif args.command == 'process-store':
+        written, skipped = preprocessor.process_store(provenance=args.provenance)
+        print(f"Appended {written} new rows, skipped {skipped} in {time.time() - start:.1f}s")
+    elif args.command == 'reprocess-stale':
+        written, stale = preprocessor.reprocess_stale()
+        print(f"Cleaned {written} stale rows again, {stale} stale rows are not in the dataset store" if stale else f"Cleaned {written} stale rows again")
+    elif args.command == 'export':
+        counts = preprocessor.export(args.split_dir, args.format, args.provenance)
+        print(f"Exported {counts} to {args.split_dir}")
+    else:
+        preprocessor.compact()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+# Mersenne prime 2^31 - 1, so (a * x + b) of two values below it fits in uint64
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+SHINGLE_BASE = np.uint64(257)
+
+
+def normalize_text(text):
+    """Function to normalize a comment before shingling, so case, links, mentions and punctuation do not hide copies."""
+    text = str(text).lower()
+    text = re.sub(r'http\S+|www\S+|https\S+', ' ', text)
+    text = re.sub(r'@\w+', ' ', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def shingle_hashes(text, k=5):
+    """Function to hash every k-character shingle of a normalized text with a rolling polynomial hash."""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    k = min(k, len(codes))
+    hashes = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        hashes = (hashes * SHINGLE_BASE + codes[j:len(codes) - k + 1 + j]) % MERSENNE_PRIME
+    return np.unique(hashes)
+
+
+def optimal_bands(num_perm, threshold):
+    """Function to pick (bands, rows) with bands * rows == num_perm whose LSH threshold (1/bands)^(1/rows) is closest."""
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class MinHasher:
+    """Computes MinHash signatures of comments from their normalized character shingles."""
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=42):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, int(MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, int(MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = shingle_hashes(normalize_text(text), self.shingle_size)
+        if len(hashes) == 0:
+            # Empty comments all share the same signature
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint32)
+        return ((self.a * hashes + self.b) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+    def signatures(self, texts):
+        return np.stack([self.signature(text) for text in texts]) if len(texts) else np.empty((0, self.num_perm), dtype=np.uint32)
+
+
+class MinHashLSH:
+    """LSH index of MinHash signatures that clusters near-duplicates as chunks of rows are added.
+
+    Signatures are split into bands and every band is hashed to a uint64. The band hashes live in NumPy arrays
+    that are sorted per band, so candidates sharing a band are found with searchsorted rather than Python
+    buckets. Rows with an identical signature are linked directly and only the first of them is banded.
+    Candidates are kept if their estimated Jaccard similarity (the fraction of equal signature values) reaches
+    the threshold, and linked in a union-find, so chains A~B~C form one cluster even when A and C are further
+    apart. Every row is indexed by its position, so only signatures, not texts, have to fit in memory.
+    """
+
+    def __init__(self, num_perm=128, threshold=0.8, seed=42):
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.bands, self.rows = optimal_bands(num_perm, threshold)
+        rng = np.random.default_rng(seed)
+        # Odd random multipliers, the products wrap around modulo 2^64
+        self._band_multipliers = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._signature_multipliers = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._size = 0
+        # Grown by doubling, so adding rows chunk by chunk stays amortised O(1) per row
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self._same_as = np.empty(1024, dtype=np.int64)
+        self._parent = []
+        self._exact = {}
+        self._band_positions = np.empty(0, dtype=np.int64)
+        self._band_hashes = np.empty((0, self.bands), dtype=np.uint64)
+        self._sorted = None
+
+    def __len__(self):
+        return self._size
+
+    def band_hashes(self, signatures):
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return (bands * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+
+    def _reserve(self, size):
+        while size > len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+            self._same_as = np.concatenate([self._same_as, np.empty_like(self._same_as)])
+
+    def _find(self, position):
+        parent = self._parent
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    def _union(self, a, b):
+        # The smaller position becomes the root, so every cluster is represented by its first row
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self._parent[max(a, b)] = min(a, b)
+
+    def _candidates(self, hashes):
+        """Return (query rows, indexed positions) of the banded rows sharing at least one band with each query."""
+        if self._sorted is None:
+            orders = [np.argsort(self._band_hashes[:, band], kind='stable') for band in range(self.bands)]
+            self._sorted = [(order, self._band_hashes[order, band]) for band, order in enumerate(orders)]
+        rows, positions = [], []
+        for band, (order, sorted_hashes) in enumerate(self._sorted):
+            low = np.searchsorted(sorted_hashes, hashes[:, band], 'left')
+            counts = np.searchsorted(sorted_hashes, hashes[:, band], 'right') - low
+            hit = np.flatnonzero(counts)
+            if not len(hit):
+                continue
+            counts = counts[hit]
+            # Concatenated ranges low[i]:low[i] + counts[i] of every query that hit
+            offsets = np.arange(counts.sum()) + np.repeat(low[hit] - (np.cumsum(counts) - counts), counts)
+            rows.append(np.repeat(hit, counts))
+            positions.append(self._band_positions[order[offsets]])
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pairs = np.unique(np.stack([np.concatenate(rows), np.concatenate(positions)], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def _similar(self, left, right, chunk_size=100000):
+        """Estimated similarity of every pair of signature rows, compared a chunk of pairs at a time."""
+        return np.concatenate([(left[start:start + chunk_size] == right[start:start + chunk_size]).mean(axis=1)
+                               for start in range(0, len(left), chunk_size)]) if len(left) else np.zeros(0)
+
+    def _chunk_pairs(self, hashes):
+        """Return the pairs (i, j), i < j, of rows of a chunk sharing at least one band."""
+        pairs = []
+        for band in range(self.bands):
+            order = np.argsort(hashes[:, band], kind='stable')
+            sorted_hashes = hashes[order, band]
+            bounds = np.concatenate([[0], np.flatnonzero(np.diff(sorted_hashes)) + 1, [len(order)]])
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if end - start > 1:
+                    i, j = np.triu_indices(end - start, 1)
+                    pairs.append(np.stack([order[start:end][i], order[start:end][j]], axis=1))
+        if not pairs:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = np.sort(np.concatenate(pairs), axis=1)
+        return np.unique(pairs, axis=0)
+
+    def add(self, signatures):
+        """Index a chunk of signatures as the next rows, linking each to the earlier and new rows it duplicates."""
+        start, count = self._size, len(signatures)
+        if not count:
+            return
+        self._reserve(start + count)
+        self._signatures[start:start + count] = signatures
+        self._parent.extend(range(start, start + count))
+
+        # Identical signatures are linked directly, only the first row of each is banded
+        full_hashes = (signatures.astype(np.uint64) * self._signature_multipliers).sum(axis=1, dtype=np.uint64)
+        banded = []
+        for i, key in enumerate(full_hashes.tolist()):
+            position = start + i
+            same = self._exact.setdefault(key, position)
+            if same != position and np.array_equal(self._signatures[same], signatures[i]):
+                self._same_as[position] = same
+                self._union(same, position)
+            else:
+                self._same_as[position] = position
+                banded.append(i)
+        banded = np.array(banded, dtype=np.int64)
+        hashes = self.band_hashes(signatures[banded])
+
+        if len(self._band_positions):
+            rows, positions = self._candidates(hashes)
+            similar = self._similar(signatures[banded[rows]], self._signatures[positions]) >= self.threshold
+            for row, position in zip(banded[rows[similar]].tolist(), positions[similar].tolist()):
+                self._union(position, start + row)
+        pairs = self._chunk_pairs(hashes)
+        similar = self._similar(signatures[banded[pairs[:, 0]]], signatures[banded[pairs[:, 1]]]) >= self.threshold
+        for i, j in banded[pairs[similar]].tolist():
+            self._union(start + i, start + j)
+
+        self._band_positions = np.concatenate([self._band_positions, start + banded])
+        self._band_hashes = np.concatenate([self._band_hashes, hashes])
+        self._sorted = None
+        self._size += count
+
+    def query(self, signatures):
+        """Return (rows, positions, similarities) of the indexed rows similar to each query signature, without adding them."""
+        empty = np.empty(0, dtype=np.int64)
+        if not len(signatures) or not len(self._band_positions):
+            return empty, empty, np.zeros(0)
+        rows, positions = self._candidates(self.band_hashes(signatures))
+        similarities = self._similar(signatures[rows], self._signatures[positions])
+        keep = similarities >= self.threshold
+        rows, positions, similarities = rows[keep], positions[keep], similarities[keep]
+
+        # Banded rows stand for every indexed row with the same signature
+        order = np.argsort(self._same_as[:self._size], kind='stable')
+        sorted_same = self._same_as[:self._size][order]
+        low = np.searchsorted(sorted_same, positions, 'left')
+        counts = np.searchsorted(sorted_same, positions, 'right') - low
+        offsets = np.arange(counts.sum()) + np.repeat(low - (np.cumsum(counts) - counts), counts)
+        return np.repeat(rows, counts), order[offsets], np.repeat(similarities, counts)
+
+    def clusters(self):
+        """Return (duplicate_of, similarity): the first row of each row's cluster, or -1 for that first row itself,
+        and the estimated similarity to it, which can be below the threshold for rows joined through a chain."""
+        positions = np.arange(self._size)
+        roots = np.array([self._find(position) for position in range(self._size)], dtype=np.int64)
+        duplicate_of = np.where(roots == positions, -1, roots)
+        similarity = np.zeros(self._size)
+        duplicates = np.flatnonzero(duplicate_of >= 0)
+        similarity[duplicates] = self._similar(self._signatures[duplicates], self._signatures[roots[duplicates]])
+        return duplicate_of, similarity
+
+
+def find_duplicates(comments, num_perm=128, threshold=0.8, shingle_size=5):
+    """Function to cluster near-duplicates in a sequence of comments, keeping the first comment of every cluster.
+
+    Returns (duplicate_of, similarity): for each comment the row of the first comment of its cluster, or -1, and
+    the estimated Jaccard similarity to it.
+    """
+    hasher = MinHasher(num_perm, shingle_size)
+    index = MinHashLSH(hasher.num_perm, threshold)
+    index.add(hasher.signatures(list(comments)))
+    return index.clusters()
+
+
+def drop_near_duplicates(df, text_column='comment', threshold=0.8, num_perm=128):
+    """Function to drop near-duplicate rows of a DataFrame, keeping the first row of every cluster."""
+    duplicate_of, _ = find_duplicates(df[text_column].astype(str).tolist(), num_perm, threshold)
+    removed = int((duplicate_of >= 0).sum())
+    print(f"Removed {removed} near-duplicate rows out of {len(df)}")
+    return df[duplicate_of < 0]
+
+
+def deduplicate_csv(input_path, output_path, text_column='comment', threshold=0.8, num_perm=128, chunksize=100000, report_path=None):
+    """Function to deduplicate a CSV in two streaming passes, writing kept rows and optionally a report of removed rows.
+
+    The first pass indexes the signatures of every chunk, so clusters are final before any row is written; the
+    second pass reads the CSV again and writes the first row of every cluster.
+    """
+    hasher = MinHasher(num_perm)
+    index = MinHashLSH(num_perm, threshold)
+    for chunk in pd.read_csv(input_path, chunksize=chunksize, usecols=[text_column]):
+        index.add(hasher.signatures(chunk[text_column].astype(str).tolist()))
+    duplicate_of, similarity = index.clusters()
+
+    offset = 0
+    report = []
+    for chunk_number, chunk in enumerate(pd.read_csv(input_path, chunksize=chunksize)):
+        is_duplicate = duplicate_of[offset:offset + len(chunk)] >= 0
+        chunk[~is_duplicate].to_csv(output_path, mode='w' if chunk_number == 0 else 'a', header=chunk_number == 0, index=False)
+        if report_path is not None and is_duplicate.any():
+            rows = offset + np.flatnonzero(is_duplicate)
+            report.append(pd.DataFrame({
+                'row': rows,
+                'duplicate_of': duplicate_of[rows],
+                'similarity': similarity[rows],
+                text_column: chunk[text_column].to_numpy()[is_duplicate],
+            }))
+        offset += len(chunk)
+    if report_path is not None:
+        (pd.concat(report) if report else pd.DataFrame(columns=['row', 'duplicate_of', 'similarity', text_column])).to_csv(report_path, index=False)
+    removed = int((duplicate_of >= 0).sum())
+    kept = len(duplicate_of) - removed
+    print(f"Kept {kept} rows, removed {removed} near-duplicates, written to {output_path}")
+    return kept, removed
+
+
+def split_leakage(splits, text_column='comment', label_column='isToxic', threshold=0.8, num_perm=128):
+    """Function to find near-duplicates shared between dataset splits, e.g. {'train': train_df, 'test': test_df}.
+
+    Splits are indexed in order and every row is checked against the rows of the earlier splits, so each leaked
+    pair is reported once. Returns (pairs, summary): one row per leaked pair, and the number and share of rows of
+    each split that have a near-duplicate in an earlier split.
+    """
+    hasher = MinHasher(num_perm)
+    index = MinHashLSH(num_perm, threshold)
+    frames = {name: pd.read_csv(split) if isinstance(split, str) else split.reset_index(drop=True) for name, split in splits.items()}
+
+    # (split, row) of every indexed position
+    keys = []
+    pairs = []
+    summary = []
+    for name, frame in frames.items():
+        texts = frame[text_column].astype(str).tolist()
+        signatures = hasher.signatures(texts)
+        # The index holds only the earlier splits while this one is queried
+        rows, positions, similarities = index.query(signatures)
+        order = np.lexsort((-similarities, rows))
+        for row, position, similarity in zip(rows[order].tolist(), positions[order].tolist(), similarities[order].tolist()):
+            other_name, other_row = keys[position]
+            pair = {'split': name, 'row': row, 'other_split': other_name, 'other_row': other_row, 'similarity': similarity,
+                    text_column: texts[row], f'other_{text_column}': frames[other_name][text_column].iloc[other_row]}
+            if label_column in frame.columns:
+                pair[label_column] = frame[label_column].iloc[row]
+                pair[f'other_{label_column}'] = frames[other_name][label_column].iloc[other_row]
+            pairs.append(pair)
+        index.add(signatures)
+        keys.extend((name, row) for row in range(len(texts)))
+        leaked = len(np.unique(rows))
+        summary.append({'split': name, 'rows': len(frame), 'leaked_rows': leaked, 'leaked_share': leaked / len(frame) if len(frame) else 0.0})
+    return pd.DataFrame(pairs), pd.DataFrame(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate detection with MinHash and LSH.")
+    parser.add_argument('--text-column', default='comment')
+    parser.add_argument('--threshold', type=float, default=0.8, help="Estimated Jaccard similarity of character shingles")
+    parser.add_argument('--num-perm', type=int, default=128)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    dedup = subparsers.add_parser('dedup', help="Drop near-duplicates from a CSV, keeping the first of every group")
+    dedup.add_argument('input')
+    dedup.add_argument('output')
+    dedup.add_argument('--report', help="CSV listing the removed rows and the row they duplicate")
+    dedup.add_argument('--chunksize', type=int, default=100000)
+
+    leakage = subparsers.add_parser('leakage', help="Report near-duplicates shared between split CSVs")
+    leakage.add_argument('splits', nargs='+', help="Split CSVs in order, e.g. train.csv val.csv test.csv")
+    leakage.add_argument('--label-column', default='isToxic')
+    leakage.add_argument('--output', help="CSV listing every leaked pair")
+    args = parser.parse_args()
+
+    if args.command == 'dedup':
+        deduplicate_csv(args.input, args.output, args.text_column, args.threshold, args.num_perm, args.chunksize, args.report)
+    else:
+        pairs, summary = split_leakage({path: path for path in args.splits}, args.text_column, args.label_column, args.threshold, args.num_perm)
+        print(summary.to_string(index=False))
+        if not pairs.empty and args.label_column in pairs.columns:
+            conflicts = (pairs[args.label_column] != pairs[f'other_{args.label_column}']).sum()
+            print(f"{len(pairs)} leaked pairs, {conflicts} with conflicting labels")
+        if args.output:
+            pairs.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
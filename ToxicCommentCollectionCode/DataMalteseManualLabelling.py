@@ -1,14 +1,33 @@
 import csv
 import os
+import sys
+import atexit
 import tkinter as tk
 from tkinter import messagebox
 
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import metrics, span, timed, increment
+from labelling_store import LabellingStore
+
 # Define the file name
 filename = "manualValDataset.csv"
 
 # Define the headers
 headers = ["Comment", "isToxic", "Reason for Toxicity", "Context/Notes"]
 
+# Local SQLite store holding the unlabelled queue, the labels and the running counters
+db_filename = "manualValDataset.db"
+
+# Scraped comments served to the annotator
+comments_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data_Collection', 'comments.csv')
+
+# Timings of label saves, queue fetches and flushes, written when the tool is closed
+metrics_filename = "labelling_metrics.prom"
+
+# Comment currently shown, as (comment_id, comment) when it was served from the queue
+current_item = None
+
 def initialize_csv():
     """Function to initialize the CSV file with headers if it does not exist."""
     if not os.path.isfile(filename):
@@ -16,8 +35,32 @@ def initialize_csv():
             writer = csv.writer(file)
             writer.writerow(headers)
 
+def append_rows_to_csv(rows):
+    """Function to append a batch of flushed labels to the CSV file in one write."""
+    if not rows:
+        return
+    with open(filename, mode='a', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerows([comment, is_toxic, reason, context] for _, comment, is_toxic, reason, context in rows)
+
+def show_next_comment():
+    """Function to load the next unlabelled comment from the queue into the Comment field."""
+    global current_item
+    with span('labelling.fetch'):
+        current_item = store.next_comment()
+    if current_item is None:
+        increment('labelling_queue_empty')
+    entry_comment.delete(0, tk.END)
+    if current_item is not None:
+        entry_comment.insert(0, current_item[1])
+    update_status()
+
+def update_status():
+    toxic_count, non_toxic_count = store.counts()
+    status_var.set(f"Toxic: {toxic_count}  Non-Toxic: {non_toxic_count}  Queue: {store.queue_size()}")
+
 def save_data():
-    """Function to save the data to the CSV file."""
+    """Function to save the data to the labelling store, flushing to the CSV file in batches."""
     comment = entry_comment.get()
     is_toxic = var_toxic.get()
     reason_for_toxicity = entry_reason.get()
@@ -27,37 +70,70 @@ def save_data():
     if is_toxic not in [0, 1]:
         messagebox.showerror("Input Error", "Toxic field must be 0 (No) or 1 (Yes)")
         return
+    if not comment.strip():
+        messagebox.showerror("Input Error", "Comment field is empty")
+        return
 
-    # Write the row to the CSV file
-    with open(filename, mode='a', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow([comment, is_toxic, reason_for_toxicity, context_notes])
+    # The comment keeps its queue id only if the annotator did not replace it with another one
+    comment_id = current_item[0] if current_item is not None and current_item[1] == comment else None
+    with span('labelling.save'):
+        append_rows_to_csv(store.add_label(comment, is_toxic, reason_for_toxicity, context_notes, comment_id))
+    increment('labels_saved', toxic=is_toxic)
 
     # Clear the input fields
-    entry_comment.delete(0, tk.END)
     var_toxic.set(0)
     entry_reason.delete(0, tk.END)
     entry_context.delete(0, tk.END)
-    messagebox.showinfo("Success", "Data saved successfully")
+    show_next_comment()
 
-def count_entries():
-    """Function to count the number of toxic and non-toxic entries in the CSV file."""
-    toxic_count = 0
-    non_toxic_count = 0
-
-    with open(filename, mode='r', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip headers
-        for row in reader:
-            if row[1] == '1':
-                toxic_count += 1
-            elif row[1] == '0':
-                non_toxic_count += 1
+def skip_comment():
+    """Function to skip the current comment without labelling it."""
+    if current_item is not None:
+        with span('labelling.skip'):
+            store.skip(current_item[0])
+        increment('comments_skipped')
+    show_next_comment()
 
+def count_entries():
+    """Function to count the number of toxic and non-toxic entries from the running counters."""
+    toxic_count, non_toxic_count = store.counts()
     messagebox.showinfo("Entry Count", f"Toxic Entries: {toxic_count}\nNon-Toxic Entries: {non_toxic_count}")
 
-# Initialize the CSV file
+@timed('labelling.export')
+def export_csv():
+    """Function to rewrite the CSV file from every label in the store, keeping rows only the CSV file had."""
+    merged = store.export_csv(filename)
+    message = f"Labels exported to {filename}"
+    if merged:
+        message += f"\n{merged} rows found only in the CSV file were merged into the store"
+    messagebox.showinfo("Export", message)
+
+def flush_pending():
+    """Function to periodically append labels to the CSV file, they are committed to the store on every save."""
+    with span('labelling.flush'):
+        append_rows_to_csv(store.flush())
+    root.after(30000, flush_pending)
+
+def on_close():
+    with span('labelling.flush'):
+        append_rows_to_csv(store.flush())
+    store.close()
+    metrics.write(metrics_filename)
+    print(metrics.report())
+    root.destroy()
+
+# Initialize the CSV file and the labelling store
 initialize_csv()
+store = LabellingStore(db_filename)
+# Rows added to the CSV file outside the tool are merged, so an export never drops them
+merged = store.import_labels(filename)
+if merged:
+    print(f"Merged {merged} labels from {filename} into the store")
+# Labels are safe in the store, this also brings the CSV file up to date when the tool exits without on_close
+atexit.register(lambda: append_rows_to_csv(store.flush()))
+imported = store.import_comments(comments_filename)
+if imported:
+    print(f"Imported {imported} new comments from {comments_filename}")
 
 # Create the main window
 root = tk.Tk()
@@ -81,11 +157,25 @@ tk.Label(root, text="Context/Notes").grid(row=3, column=0, padx=10, pady=5)
 entry_context = tk.Entry(root, width=50)
 entry_context.grid(row=3, column=1, padx=10, pady=5)
 
-# Create and place the Save button
-tk.Button(root, text="Save", command=save_data).grid(row=4, column=0, columnspan=2, pady=10)
+# Create and place the Save and Skip buttons
+tk.Button(root, text="Save", command=save_data).grid(row=4, column=0, pady=10)
+tk.Button(root, text="Skip (Esc)", command=skip_comment).grid(row=4, column=1, pady=10)
+
+# Create and place the Count and Export buttons
+tk.Button(root, text="Count Entries", command=count_entries).grid(row=5, column=0, pady=10)
+tk.Button(root, text="Export CSV", command=export_csv).grid(row=5, column=1, pady=10)
+
+# Running counters and queue size
+status_var = tk.StringVar()
+tk.Label(root, textvariable=status_var).grid(row=6, column=0, columnspan=2, pady=5)
+
+# Keyboard shortcuts so the annotator does not need the mouse
+root.bind('<Control-Return>', lambda event: save_data())
+root.bind('<Escape>', lambda event: skip_comment())
 
-# Create and place the Count button
-tk.Button(root, text="Count Entries", command=count_entries).grid(row=5, column=0, columnspan=2, pady=10)
+show_next_comment()
+root.after(30000, flush_pending)
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 # Start the main event loop
 root.mainloop()
@@ -5,6 +5,7 @@ import json
 import signal
 import csv
 import random
+import sys
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.support import expected_conditions as EC
@@ -14,6 +15,10 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from google.cloud import translate_v2 as translate
 
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import metrics, span, timed, increment
+
 # Load environment variables
 load_dotenv()
 EMAIL = os.getenv("EMAIL")
@@ -44,6 +49,9 @@ driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), opti
 csv_dir = 'ToxicCommentCollectionCode/Data_Collection'  # Ensure this is a relative path
 csv_filename = os.path.join(csv_dir, 'comments.csv')
 
+# Stage timings and counters of the run, written when comments are saved
+metrics_filename = os.path.join(csv_dir, 'scraper_metrics.prom')
+
 # Ensure the directory exists
 os.makedirs(csv_dir, exist_ok=True)
 
@@ -58,7 +66,13 @@ def load_existing_comments():
                 existing_comments.add(row[0])
     return existing_comments
 
+# Function to write the stage timings and counters of the run
+def save_metrics():
+    metrics.write(metrics_filename)
+    print(metrics.report())
+
 # Function to save comments to CSV file
+@timed('scraper.save_comments')
 def save_comments_to_csv(comments):
     if not comments:
         return
@@ -80,6 +94,7 @@ def save_comments_to_csv(comments):
 def signal_handler(sig, frame):
     print("Interrupted! Saving comments to CSV file.")
     save_comments_to_csv(all_comments)
+    save_metrics()
     driver.quit()
     exit(0)
 
@@ -87,12 +102,14 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 # Function to introduce random delay
+@timed('scraper.random_delay')
 def random_delay(min_seconds=1, max_seconds=5):
     delay = random.uniform(min_seconds, max_seconds)
     print(f"Waiting for {delay:.2f} seconds...")
     time.sleep(delay)
 
 # Function to detect if text is in Maltese
+@timed('scraper.is_maltese')
 def is_maltese(text, confidence_threshold=0.70):
     if text.strip() == "":
         return False
@@ -103,9 +120,11 @@ def is_maltese(text, confidence_threshold=0.70):
         return False
     except Exception as e:
         print(f"Error detecting language: {e}")
+        increment('scraper_language_errors')
         return False
 
 # Function to remove names and surnames, mentions, and emojis
+@timed('scraper.clean_text')
 def clean_text(text):
     # Remove <a href> tags and their content
     text = re.sub(r'<a href="[^"]*">[^<]*</a>', '', text)
@@ -183,19 +202,21 @@ def replies_scraping(seen_comments):
     while True:
         random_delay(1, 2)
         
-        box_replies = driver.find_elements(
-            By.XPATH,
-            '//div[@id="root"]/div[@class]/div[not(@id)]/div[div]',
-        )
+        with span('scraper.fetch', page='replies'):
+            box_replies = driver.find_elements(
+                By.XPATH,
+                '//div[@id="root"]/div[@class]/div[not(@id)]/div[div]',
+            )
         if len(box_replies) > 0:
             for idx, box in enumerate(box_replies):
-                reply_by = box.find_element(By.XPATH, 'div/h3').text
-                try:
-                    reply_to = box.find_element(By.XPATH, 'div/div[1]/a').text
-                except:
-                    reply_to = None
-                reply_array = box.find_elements(By.XPATH, "div/div[1]")
-                reply_comment = ''.join([span.text for span in reply_array])
+                with span('scraper.fetch', page='reply'):
+                    reply_by = box.find_element(By.XPATH, 'div/h3').text
+                    try:
+                        reply_to = box.find_element(By.XPATH, 'div/div[1]/a').text
+                    except:
+                        reply_to = None
+                    reply_array = box.find_elements(By.XPATH, "div/div[1]")
+                    reply_comment = ''.join([element.text for element in reply_array])
                 if reply_to is not None:
                     reply_comment = reply_comment.replace(f'{reply_to} ', '')
                 
@@ -211,11 +232,15 @@ def replies_scraping(seen_comments):
                     
                     reply_identifier = f"{reply['reply_by']}: {reply['reply']}"
                     if reply_identifier in seen_comments:
+                        increment('scraper_comments', kind='reply', status='duplicate')
                         continue
                     seen_comments.add(reply_identifier)
+                    increment('scraper_comments', kind='reply', status='kept')
 
                     print(f"{reply['reply_by']}{ ' To ' + reply.get('reply_to', '') if reply.get('reply_to', None) else '' } -> reply: {reply['reply']}")
                     replies.append(reply)
+                else:
+                    increment('scraper_comments', kind='reply', status='not_maltese')
                 
         if next_page_btn_id is None:
             try:
@@ -258,14 +283,16 @@ def comments_scraping(seen_comments):
     while True:
         random_delay(1, 2)
         
-        box_comments = driver.find_elements(
-            By.XPATH,
-            '//*[@id="m_story_permalink_view"]/div[@id]/div/div[not(@id)]/div[div]',
-        )
+        with span('scraper.fetch', page='comments'):
+            box_comments = driver.find_elements(
+                By.XPATH,
+                '//*[@id="m_story_permalink_view"]/div[@id]/div/div[not(@id)]/div[div]',
+            )
         if len(box_comments) > 0:
             for box_comment in box_comments:
-                comment_by = box_comment.find_element(By.XPATH, "div/h3").text
-                comment_text = box_comment.find_element(By.XPATH, "div/div[1]").text
+                with span('scraper.fetch', page='comment'):
+                    comment_by = box_comment.find_element(By.XPATH, "div/h3").text
+                    comment_text = box_comment.find_element(By.XPATH, "div/div[1]").text
                 comment_text = clean_text(comment_text)
                 
                 if is_maltese(comment_text):
@@ -273,8 +300,10 @@ def comments_scraping(seen_comments):
                     
                     comment_identifier = f"{comment['comment_by']}: {comment['comment']}"
                     if comment_identifier in seen_comments:
+                        increment('scraper_comments', kind='comment', status='duplicate')
                         continue
                     seen_comments.add(comment_identifier)
+                    increment('scraper_comments', kind='comment', status='kept')
                     
                     print(f"{comment_by} -> comment: {comment_text}")
 
@@ -296,6 +325,8 @@ def comments_scraping(seen_comments):
                         random_delay(1, 2)
                         driver.switch_to.window(driver.window_handles[1])
                     comments.append(comment)
+                else:
+                    increment('scraper_comments', kind='comment', status='not_maltese')
 
         if next_page_btn_id is None:
             try:
@@ -431,10 +462,12 @@ def scrape_search_results():
 # search_url = "https://mbasic.facebook.com/search/posts/?q=Malta"
 search_url = "https://mbasic.facebook.com/groups/631352428861145"
 
-driver.get(search_url)
+with span('scraper.fetch', page='search'):
+    driver.get(search_url)
 scrape_search_results()
 
 # Save comments to CSV file upon normal completion
 print("Saving comments to CSV file.")
 save_comments_to_csv(all_comments)
-print("Comments saved to CSV file.")
\ No newline at end of file
+print("Comments saved to CSV file.")
+save_metrics()
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import sys
+import csv
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+
+# inference.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from labelling_store import LabellingStore
+
+SCORES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    model_key TEXT NOT NULL,
+    comment_hash TEXT NOT NULL,
+    probability REAL NOT NULL,
+    PRIMARY KEY (model_key, comment_hash)
+);
+"""
+
+
+def comment_hash(comment):
+    return hashlib.sha1(comment.encode('utf-8')).hexdigest()
+
+
+class ScoreCache:
+    """Toxicity probabilities per (checkpoint, comment), so only new comments are scored on later runs."""
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCORES_SCHEMA)
+
+    def get(self, key, hashes):
+        found = {}
+        for start in range(0, len(hashes), 900):
+            chunk = hashes[start:start + 900]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(self.conn.execute(
+                f"SELECT comment_hash, probability FROM scores WHERE model_key = ? AND comment_hash IN ({placeholders})",
+                (key, *chunk),
+            ).fetchall())
+        return found
+
+    def put(self, key, hashes, probabilities):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO scores (model_key, comment_hash, probability) VALUES (?, ?, ?)",
+                                  [(key, h, float(p)) for h, p in zip(hashes, probabilities)])
+
+
+def score_pool(comments, models, cache, batch_size=64, max_length=128):
+    """Function to score the pool with every model, running the models only on comments without a cached score.
+
+    Returns an array of shape (len(models), len(comments)) with toxicity probabilities.
+    """
+    from inference import model_key, load_model_and_tokenizer, predict_probabilities
+
+    hashes = [comment_hash(comment) for comment in comments]
+    probabilities = np.empty((len(models), len(comments)), dtype=np.float32)
+    for m, (model_name, model_path, model_base) in enumerate(models):
+        key = model_key(model_name, model_path)
+        cached = cache.get(key, hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        print(f"{model_name}: {len(comments) - len(missing)} cached scores, scoring {len(missing)} new comments")
+
+        if missing:
+            tokenizer, model = load_model_and_tokenizer(model_path, model_base)
+            new_probabilities = predict_probabilities(tokenizer, model, [comments[i] for i in missing], batch_size, max_length)
+            cache.put(key, [hashes[i] for i in missing], new_probabilities)
+            cached.update(zip((hashes[i] for i in missing), new_probabilities))
+            del model
+        probabilities[m] = [cached[h] for h in hashes]
+    return probabilities
+
+
+def uncertainty_scores(probabilities):
+    """Function to rank comments by how unsure the model (or ensemble) is.
+
+    Uncertainty is 1 at p=0.5 and 0 at p=0 or p=1 on the ensemble mean. With several models the standard
+    deviation of their probabilities (disagreement, at most 0.5) is added, so contested comments rank first.
+    """
+    mean = probabilities.mean(axis=0)
+    uncertainty = 1.0 - np.abs(2.0 * mean - 1.0)
+    if probabilities.shape[0] > 1:
+        uncertainty = uncertainty + 2.0 * probabilities.std(axis=0)
+    return uncertainty
+
+
+def select_diverse(comments, scores, top_k, candidate_factor=10, max_similarity=0.8):
+    """Function to pick top_k comments by score, skipping near-copies of already selected comments.
+
+    Candidates are the top_k * candidate_factor comments by score, compared with character n-gram
+    vectors so copy-pastes and reply variants of the same comment do not use up the labelling budget.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    candidates = np.argsort(-scores, kind='stable')[:top_k * candidate_factor]
+    vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 5), n_features=2 ** 18, alternate_sign=False, norm='l2')
+    vectors = vectorizer.transform([comments[i] for i in candidates])
+
+    selected = []
+    max_similarity_to_selected = np.zeros(len(candidates))
+    for position, index in enumerate(candidates):
+        if len(selected) >= top_k:
+            break
+        if max_similarity_to_selected[position] > max_similarity:
+            continue
+        selected.append(index)
+        similarity = (vectors @ vectors[position].T).toarray().ravel()
+        np.maximum(max_similarity_to_selected, similarity, out=max_similarity_to_selected)
+    return np.array(selected, dtype=int)
+
+
+def read_comments(csv_path):
+    """Function to read comments.csv (one comment per row, no header), keeping the first copy of each comment."""
+    seen = set()
+    comments = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if row and row[0].strip() and row[0] not in seen:
+                seen.add(row[0])
+                comments.append(row[0])
+    return comments
+
+
+def select_for_labelling(comments_path, models, store, cache, top_k=200, batch_size=64, max_length=128, max_similarity=0.8):
+    """Score the unlabelled pool, select the top_k most informative comments and queue them first for labelling.
+
+    Returns a list of (comment, score, mean probability) for the selected comments in priority order.
+    """
+    # Only queued comments are candidates: skipped ones would take top_k slots the labelling tool never serves
+    queued = store.queued_comments()
+    comments = [comment for comment in read_comments(comments_path) if comment in queued]
+    if not comments:
+        print("No queued comments left to select from.")
+        return []
+
+    probabilities = score_pool(comments, models, cache, batch_size, max_length)
+    scores = uncertainty_scores(probabilities)
+    selected = select_diverse(comments, scores, top_k, max_similarity=max_similarity)
+
+    # Higher priority is served first by the labelling tool
+    store.set_priorities([(comments[i], float(len(selected) - rank)) for rank, i in enumerate(selected)])
+    mean = probabilities.mean(axis=0)
+    return [(comments[i], float(scores[i]), float(mean[i])) for i in selected]
+
+
+def main():
+    from inference import models_validation
+
+    parser = argparse.ArgumentParser(description="Queue the most informative unlabelled comments for labelling.")
+    parser.add_argument('--models', nargs='+', default=['mBERTu_FT'],
+                        help="Names from models_validation, several names score with an ensemble: " + ", ".join(m[0] for m in models_validation))
+    parser.add_argument('--comments', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data_Collection', 'comments.csv'))
+    parser.add_argument('--db', default='manualValDataset.db', help="Labelling store used by DataMalteseManualLabelling.py")
+    parser.add_argument('--top-k', type=int, default=200)
+    parser.add_argument('--max-similarity', type=float, default=0.8, help="Skip comments more similar than this to one already selected")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--export', help="Also write the selected comments to this CSV, e.g. for GPT labelling")
+    args = parser.parse_args()
+
+    models = [model for model in models_validation if model[0] in args.models]
+    if len(models) != len(args.models):
+        parser.error(f"Unknown model in {args.models}")
+
+    store = LabellingStore(args.db)
+    store.import_comments(args.comments)
+    selected = select_for_labelling(args.comments, models, store, ScoreCache(args.db), args.top_k, args.batch_size,
+                                    max_similarity=args.max_similarity)
+    store.close()
+    print(f"Queued {len(selected)} comments for labelling.")
+
+    if args.export:
+        with open(args.export, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['comment', 'uncertainty', 'probability'])
+            writer.writerows(selected)
+        print(f"Selected comments written to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import os
+import csv
+import sqlite3
+import time
+from collections import deque
+
+# Headers of manualValDataset.csv
+EXPORT_HEADERS = ["Comment", "isToxic", "Reason for Toxicity", "Context/Notes"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    comment TEXT NOT NULL UNIQUE,
+    priority REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    imported_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_comments_queue ON comments (status, priority DESC, id);
+
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    comment_id INTEGER REFERENCES comments (id),
+    comment TEXT NOT NULL,
+    is_toxic INTEGER NOT NULL,
+    reason TEXT,
+    context TEXT,
+    labelled_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('toxic', 0), ('non_toxic', 0);
+"""
+
+
+class LabellingStore:
+    """SQLite-backed queue of unlabelled comments and their labels.
+
+    Every label is committed at once together with the running toxic/non-toxic counters, so a crash loses
+    nothing; in WAL mode with synchronous=NORMAL a commit is an append to the log without an fsync. Rows for
+    the CSV file are handed back in batches and the next comments are prefetched, so each click stays cheap.
+    """
+
+    def __init__(self, db_path, batch_size=20, prefetch_size=20):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.prefetch_size = prefetch_size
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Labels already committed but not yet returned for appending to the CSV file
+        self.pending = []
+        self.prefetched = deque()
+        self.in_flight = set()
+
+    def import_comments(self, csv_path, has_header=False, chunk_size=10000):
+        """Function to stream comments.csv into the queue, ignoring comments that are already stored."""
+        if not os.path.isfile(csv_path):
+            return 0
+        before = self.conn.total_changes
+        now = time.time()
+        with open(csv_path, newline='', encoding='utf-8') as f, self.conn:
+            reader = csv.reader(f)
+            if has_header:
+                next(reader, None)
+            chunk = []
+            for row in reader:
+                if row and row[0].strip():
+                    chunk.append((row[0], now))
+                if len(chunk) >= chunk_size:
+                    self.conn.executemany("INSERT OR IGNORE INTO comments (comment, imported_at) VALUES (?, ?)", chunk)
+                    chunk = []
+            self.conn.executemany("INSERT OR IGNORE INTO comments (comment, imported_at) VALUES (?, ?)", chunk)
+            imported = self.conn.total_changes - before
+            # Comments labelled before they were imported are not served again
+            self.conn.execute("UPDATE comments SET status = 'labelled' WHERE status = 'queued' AND comment IN (SELECT comment FROM labels)")
+        return imported
+
+    def import_labels(self, csv_path):
+        """Function to merge the labels of manualValDataset.csv that the store does not have, e.g. rows added by hand."""
+        if not os.path.isfile(csv_path):
+            return 0
+        known = set(self.conn.execute("SELECT comment, is_toxic, COALESCE(reason, ''), COALESCE(context, '') FROM labels"))
+        rows = []
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # Skip headers
+            for row in reader:
+                if len(row) >= 2 and row[1] in ('0', '1'):
+                    label = (row[0], int(row[1]), row[2] if len(row) > 2 else '', row[3] if len(row) > 3 else '')
+                    if label not in known:
+                        known.add(label)
+                        rows.append(label)
+        if rows:
+            self._write_labels([(None, *row) for row in rows])
+        return len(rows)
+
+    def next_comment(self):
+        """Return the next (comment_id, comment) to label, or None when the queue is empty."""
+        if len(self.prefetched) < max(1, self.prefetch_size // 4):
+            self._prefetch()
+        if not self.prefetched:
+            return None
+        item = self.prefetched.popleft()
+        self.in_flight.add(item[0])
+        return item
+
+    def _prefetch(self):
+        exclude = self.in_flight | {item[0] for item in self.prefetched}
+        rows = self.conn.execute(
+            "SELECT id, comment FROM comments WHERE status = 'queued' ORDER BY priority DESC, id LIMIT ?",
+            (self.prefetch_size + len(exclude),),
+        ).fetchall()
+        for row in rows:
+            if row[0] not in exclude and len(self.prefetched) < self.prefetch_size:
+                self.prefetched.append(row)
+
+    def add_label(self, comment, is_toxic, reason='', context='', comment_id=None):
+        """Commit a label, returning the labels to append to the CSV file once batch_size of them are pending."""
+        row = (comment_id, comment, int(is_toxic), reason, context)
+        self._write_labels([row])
+        self.pending.append(row)
+        self.in_flight.discard(comment_id)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def skip(self, comment_id):
+        """Move a comment out of the queue without labelling it."""
+        self.in_flight.discard(comment_id)
+        with self.conn:
+            self.conn.execute("UPDATE comments SET status = 'skipped' WHERE id = ?", (comment_id,))
+
+    def flush(self):
+        """Return the labels not yet appended to the CSV file, they are already committed to the database."""
+        flushed, self.pending = self.pending, []
+        return flushed
+
+    def _write_labels(self, rows):
+        now = time.time()
+        toxic = sum(1 for row in rows if row[2] == 1)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO labels (comment_id, comment, is_toxic, reason, context, labelled_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+            self.conn.executemany("UPDATE comments SET status = 'labelled' WHERE id = ?",
+                                  [(row[0],) for row in rows if row[0] is not None])
+            # Comments typed or pasted by hand are matched to the queue by their text
+            self.conn.executemany("UPDATE comments SET status = 'labelled' WHERE comment = ?",
+                                  [(row[1],) for row in rows if row[0] is None])
+            self.conn.execute("UPDATE counters SET value = value + ? WHERE name = 'toxic'", (toxic,))
+            self.conn.execute("UPDATE counters SET value = value + ? WHERE name = 'non_toxic'", (len(rows) - toxic,))
+
+    def counts(self):
+        """Return (toxic, non_toxic) label counts."""
+        counters = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+        return counters['toxic'], counters['non_toxic']
+
+    def queue_size(self):
+        queued = self.conn.execute("SELECT COUNT(*) FROM comments WHERE status = 'queued'").fetchone()[0]
+        return queued - len(self.in_flight)
+
+    def set_priorities(self, priorities):
+        """Function to reorder the queue from (comment, priority) pairs, resetting the priority of every other queued comment."""
+        now = time.time()
+        with self.conn:
+            # Picks of earlier rounds, possibly by an older checkpoint, must not outrank the new selection
+            self.conn.execute("UPDATE comments SET priority = 0 WHERE status = 'queued'")
+            self.conn.executemany("INSERT OR IGNORE INTO comments (comment, imported_at) VALUES (?, ?)",
+                                  [(comment, now) for comment, _ in priorities])
+            self.conn.executemany("UPDATE comments SET priority = ? WHERE comment = ?",
+                                  [(priority, comment) for comment, priority in priorities])
+        # Served items must follow the new order
+        self.prefetched.clear()
+
+    def labelled_comments(self):
+        """Return the set of comments that already have a label."""
+        return {row[0] for row in self.conn.execute("SELECT comment FROM labels")}
+
+    def queued_comments(self):
+        """Return the set of comments still waiting for a label, leaving out skipped and labelled ones."""
+        return {row[0] for row in self.conn.execute("SELECT comment FROM comments WHERE status = 'queued'")}
+
+    def export_csv(self, csv_path):
+        """Function to rewrite manualValDataset.csv from every label, returning how many rows only the CSV had.
+
+        Rows of the existing file that the store does not know are merged into the store first, so the rewrite
+        never drops them, and the file is replaced atomically.
+        """
+        merged = self.import_labels(csv_path)
+        self.pending = []
+        with open(csv_path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_HEADERS)
+            writer.writerows(self.conn.execute("SELECT comment, is_toxic, reason, context FROM labels ORDER BY id"))
+        os.replace(csv_path + '.tmp', csv_path)
+        return merged
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,247 @@
+import os
+import json
+import hashlib
+import argparse
+import traceback
+from concurrent.futures import as_completed
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+from worker_pool import plan_workers, pinned_pool, worker_threads
+
+# (name, tokenizer / model name, pretrained model path) as in Training-cross-validation.ipynb
+DEFAULT_MODELS = [
+    ('mBERTu', 'MLRS/mBERTu', 'MLRS/mBERTu'),
+    ('BERT', 'bert-base-uncased', 'bert-base-uncased'),
+    ('XLM-R', 'xlm-roberta-base', 'xlm-roberta-base'),
+    ('RoBERTa', 'roberta-base', 'roberta-base'),
+]
+
+RESULTS_FILE = 'results.json'
+# What the folds or a job were produced from, checked before they are reused on a restart
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_folds(data_path, output_dir, n_splits=5, seed=42):
+    """Function to split a dataset into stratified folds, writing each fold's train.csv and val.csv once.
+
+    Fold files are reused only while the manifest (data hash, n_splits, seed) matches, so their content (and
+    tokenization cache key) is stable across restarts. Return (fold_paths, manifest).
+    """
+    folds_dir = os.path.join(output_dir, 'folds')
+    fold_paths = [(os.path.join(folds_dir, f'fold_{k}', 'train.csv'), os.path.join(folds_dir, f'fold_{k}', 'val.csv'))
+                  for k in range(n_splits)]
+    manifest = {'data_sha256': file_sha256(data_path), 'n_splits': n_splits, 'seed': seed}
+    if read_manifest(folds_dir) == manifest and all(os.path.isfile(train_path) and os.path.isfile(val_path)
+                                                    for train_path, val_path in fold_paths):
+        return fold_paths, manifest
+
+    print(f"Writing {n_splits} folds of {data_path}")
+    os.makedirs(folds_dir, exist_ok=True)
+    # The old manifest goes first, so folds interrupted half-way are never taken as complete
+    if os.path.isfile(os.path.join(folds_dir, MANIFEST_FILE)):
+        os.remove(os.path.join(folds_dir, MANIFEST_FILE))
+    data = pd.read_csv(data_path)
+    data['comment'] = data['comment'].fillna('').astype(str)
+    data['isToxic'] = data['isToxic'].fillna(0).astype(int)
+    skf = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    for (train_path, val_path), (train_idx, val_idx) in zip(fold_paths, skf.split(data, data['isToxic'])):
+        os.makedirs(os.path.dirname(train_path), exist_ok=True)
+        for path, idx in ((train_path, train_idx), (val_path, val_idx)):
+            data.iloc[idx].to_csv(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+    write_json_atomic(os.path.join(folds_dir, MANIFEST_FILE), manifest)
+    return fold_paths, manifest
+
+
+def job_dir(output_dir, model_label, fold):
+    return os.path.join(output_dir, 'runs', model_label, f'fold_{fold}')
+
+
+def job_manifest(job, folds_manifest):
+    """What a job's results depend on: the folds, the model and the training hyperparameters."""
+    manifest = dict(folds_manifest, fold=job['fold'], model_name=job['model_name'],
+                    pretrained_model_path=job['pretrained_model_path'], train_kwargs=job['train_kwargs'])
+    # Round-trip through JSON so tuples and lists compare equal to the stored manifest
+    return json.loads(json.dumps(manifest))
+
+
+def is_completed(directory, manifest=None):
+    if not os.path.isfile(os.path.join(directory, RESULTS_FILE)):
+        return False
+    return manifest is None or read_manifest(directory) == manifest
+
+
+def run_job(job):
+    """Train one (model, fold) job in its own output directory and mark it completed with results.json."""
+    from training_engine import train_and_evaluate_model
+
+    directory = job['job_dir']
+    os.makedirs(directory, exist_ok=True)
+    # Stale results of a different configuration must not count once the new manifest is written
+    if os.path.isfile(os.path.join(directory, RESULTS_FILE)):
+        os.remove(os.path.join(directory, RESULTS_FILE))
+    write_json_atomic(os.path.join(directory, MANIFEST_FILE), job['manifest'])
+    results = train_and_evaluate_model(
+        model_name=job['model_name'],
+        pretrained_model_path=job['pretrained_model_path'],
+        train_data=job['train_path'],
+        val_data=job['val_path'],
+        save_path=directory,
+        checkpoint_dir=directory,
+        num_threads=worker_threads(),
+        plot=False,
+        **job['train_kwargs'],
+    )
+    summary = {
+        'Model': job['model_label'],
+        'Fold': job['fold'],
+        'Best Epoch': results['best_epoch'],
+        'Epochs Run': len(results['val_losses']),
+        'Train Time (s)': sum(results['epoch_times']),
+    }
+    summary.update({f'Val {name}': value for name, value in results['best_val_metrics'].items()})
+
+    # Written last and atomically: a job only counts as completed once its model and metrics are saved
+    write_json_atomic(os.path.join(directory, RESULTS_FILE), summary)
+    return summary
+
+
+def aggregate_results(output_dir, models, n_splits, manifests=None):
+    """Function to collect the results of all completed jobs into a per-fold table and a per-model summary.
+
+    manifests maps (model_label, fold) to the expected job manifest, results of other configurations are left out.
+    """
+    rows = []
+    for model_label, _, _ in models:
+        for fold in range(n_splits):
+            directory = job_dir(output_dir, model_label, fold)
+            if manifests is not None and read_manifest(directory) != manifests[model_label, fold]:
+                continue
+            results_path = os.path.join(directory, RESULTS_FILE)
+            if os.path.isfile(results_path):
+                with open(results_path, encoding='utf-8') as f:
+                    rows.append(json.load(f))
+    results = pd.DataFrame(rows)
+    if results.empty:
+        return results, results
+
+    metric_columns = [column for column in results.columns if column.startswith('Val ')]
+    summary = results.groupby('Model')[metric_columns].agg(['mean', 'std'])
+    summary.columns = [f'{metric} ({stat})' for metric, stat in summary.columns]
+    summary.insert(0, 'Folds', results.groupby('Model').size())
+    summary = summary.reset_index()
+
+    results.to_csv(os.path.join(output_dir, 'cv_results.csv'), index=False)
+    summary.to_csv(os.path.join(output_dir, 'cv_summary.csv'), index=False)
+    return results, summary
+
+
+def run_cross_validation(data_path, output_dir, models=DEFAULT_MODELS, n_splits=5, num_workers=None, threads_per_job=None, seed=42, **train_kwargs):
+    """Run k-fold cross-validation for several models, scheduling (model, fold) jobs across a process pool.
+
+    Every job trains into output_dir/runs/<model>/fold_<k>/ and is skipped on restart once its results.json
+    exists and its manifest matches the data, folds and hyperparameters, so a crash only loses the jobs that were
+    running. Extra keyword arguments go to train_and_evaluate_model.
+    """
+    fold_paths, folds_manifest = write_folds(data_path, output_dir, n_splits, seed)
+    train_kwargs.setdefault('num_workers', 0)
+    train_kwargs.setdefault('num_interop_threads', None)
+
+    jobs = []
+    manifests = {}
+    for model_label, model_name, pretrained_model_path in models:
+        for fold, (train_path, val_path) in enumerate(fold_paths):
+            directory = job_dir(output_dir, model_label, fold)
+            job = {
+                'model_label': model_label,
+                'model_name': model_name,
+                'pretrained_model_path': pretrained_model_path,
+                'fold': fold,
+                'train_path': train_path,
+                'val_path': val_path,
+                'job_dir': directory,
+                'train_kwargs': train_kwargs,
+            }
+            job['manifest'] = manifests[model_label, fold] = job_manifest(job, folds_manifest)
+            if is_completed(directory, job['manifest']):
+                print(f"Skipping {model_label} fold {fold}: already completed.")
+                continue
+            jobs.append(job)
+
+    if jobs:
+        num_workers, threads_per_job = plan_workers(len(jobs), num_workers, threads_per_job)
+        print(f"Running {len(jobs)} jobs on {num_workers} workers with {threads_per_job} threads each")
+
+        with pinned_pool(num_workers, threads_per_job) as executor:
+            futures = {executor.submit(run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    summary = future.result()
+                    print(f"Completed {job['model_label']} fold {job['fold']}: Val Loss {summary['Val Loss']:.4f}, Val F1 Score {summary['Val F1 Score']:.4f}")
+                except Exception:
+                    print(f"Job {job['model_label']} fold {job['fold']} failed, it will be retried on the next run:")
+                    traceback.print_exc()
+
+    results, summary = aggregate_results(output_dir, models, n_splits, manifests)
+    if not summary.empty:
+        print(summary.to_string(index=False))
+    return results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel k-fold cross-validation with per-job resume.")
+    parser.add_argument('--data', required=True, help="CSV with 'comment' and 'isToxic' columns to split into folds")
+    parser.add_argument('--output-dir', required=True, help="Directory for folds, per-job runs and result tables")
+    parser.add_argument('--models', nargs='+', help="Subset of model labels to run: " + ", ".join(label for label, _, _ in DEFAULT_MODELS))
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help="Number of jobs trained in parallel")
+    parser.add_argument('--threads-per-job', type=int, help="CPU threads per job, defaults to cores / workers")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--accumulation-steps', type=int, default=4)
+    parser.add_argument('--patience', type=int, default=3)
+    parser.add_argument('--lr', type=float, default=2e-5)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--precision', choices=['auto', 'fp32', 'bf16', 'fp16'], default='auto')
+    args = parser.parse_args()
+
+    models = DEFAULT_MODELS
+    if args.models:
+        models = [model for model in DEFAULT_MODELS if model[0] in args.models]
+
+    run_cross_validation(
+        args.data, args.output_dir, models=models, n_splits=args.folds, num_workers=args.workers,
+        threads_per_job=args.threads_per_job, seed=args.seed, batch_size=args.batch_size,
+        max_length=args.max_length, accumulation_steps=args.accumulation_steps,
+        early_stopping_patience=args.patience, learning_rate=args.lr, num_epochs=args.epochs,
+        precision=args.precision,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from training_engine import compute_metrics
+
+# inference.py and student_model.py live in the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_DIR)
+import inference
+from student_model import FastTextStudent, SubwordHasher
+
+SOFT_LABEL_COLUMN = 'teacher_probability'
+
+# Entry of inference.models_validation the student is saved to, its base is the teacher
+STUDENT_MODEL = 'mBERTu_FT_Student'
+TEACHER_MODEL = 'mBERTu_FT'
+
+# Default location of the soft labels and benchmark results, so they do not depend on the working directory
+DEFAULT_OUTPUT_DIR = os.path.join(REPO_DIR, 'temp', 'distillation')
+
+
+def find_model(model_choice):
+    """Function to look up a models_validation entry with its path resolved against the repository root."""
+    model_name, model_path, model_base = inference.find_model(model_choice)
+    return model_name, os.path.normpath(os.path.join(REPO_DIR, model_path)), model_base
+
+
+def read_corpus(csv_path):
+    """Function to read the scraped comments.csv (one comment per row, no header) without duplicates."""
+    seen = set()
+    comments = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if row and row[0].strip() and row[0] not in seen:
+                seen.add(row[0])
+                comments.append(row[0])
+    return comments
+
+
+def soft_label_corpus(comments_path, output_path, teacher=TEACHER_MODEL, batch_size=64, max_length=128, chunk_size=2000):
+    """Function to score the unlabelled corpus with the teacher, appending to output_path so an interrupted run resumes."""
+    comments = read_corpus(comments_path)
+    done = set(pd.read_csv(output_path)['comment'].astype(str)) if os.path.isfile(output_path) else set()
+    remaining = [comment for comment in comments if comment not in done]
+    print(f"Soft-labelling {len(remaining)} of {len(comments)} comments with {teacher}")
+    if not remaining:
+        return output_path
+
+    _, model_path, model_base = find_model(teacher)
+    tokenizer, model = inference.load_model_and_tokenizer(model_path, model_base)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    for start in range(0, len(remaining), chunk_size):
+        chunk = remaining[start:start + chunk_size]
+        probabilities = inference.predict_probabilities(tokenizer, model, chunk, batch_size, max_length)
+        pd.DataFrame({'comment': chunk, SOFT_LABEL_COLUMN: probabilities}).to_csv(
+            output_path, mode='a', header=not os.path.isfile(output_path), index=False)
+        print(f"Soft-labelled {min(start + chunk_size, len(remaining))}/{len(remaining)} comments")
+    return output_path
+
+
+def _load_labelled(csv_path):
+    data = pd.read_csv(csv_path)
+    return data['comment'].fillna('').astype(str).tolist(), data['isToxic'].fillna(0).astype(int).to_numpy()
+
+
+def evaluate_student(model, comments, labels, batch_size=256):
+    probabilities = model.predict_probabilities(comments, batch_size)
+    eps = 1e-7
+    loss = float(-np.mean(labels * np.log(probabilities + eps) + (1 - labels) * np.log(1 - probabilities + eps)))
+    return compute_metrics(labels, (probabilities > inference.THRESHOLD).astype(int), loss)
+
+
+def train_student(soft_labels_path, val_data, output_dir, train_data=None, teacher=TEACHER_MODEL, embedding_dim=64,
+                  num_buckets=2 ** 18, num_epochs=10, batch_size=64, learning_rate=0.05, early_stopping_patience=3, seed=42):
+    """Train a fastText-style student on the teacher's soft labels, optionally adding the labelled training set.
+
+    The student is trained with binary cross-entropy against the teacher probabilities (hard 0/1 targets for
+    rows of train_data), validated on the labelled val_data, and the epoch with the best validation F1 is saved.
+    """
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    soft_labels = pd.read_csv(soft_labels_path)
+    comments = soft_labels['comment'].astype(str).tolist()
+    targets = soft_labels[SOFT_LABEL_COLUMN].astype(np.float32).to_numpy()
+    if train_data is not None:
+        train_comments, train_labels = _load_labelled(train_data)
+        comments += train_comments
+        targets = np.concatenate([targets, train_labels.astype(np.float32)])
+    val_comments, val_labels = _load_labelled(val_data)
+
+    hasher = SubwordHasher(num_buckets)
+    # Features are hashed once, the embedding lookups are all that runs per epoch
+    encoded = [hasher.encode(comment) for comment in comments]
+    model = FastTextStudent(hasher, embedding_dim)
+    print(f"Student: {model.num_parameters():,} parameters ({model.num_parameters() * 4 / 2 ** 20:.1f} MB in fp32)")
+    sparse_optimizer = torch.optim.SparseAdam(list(model.embedding.parameters()), lr=learning_rate)
+    dense_optimizer = torch.optim.Adam(model.classifier.parameters(), lr=learning_rate)
+    criterion = nn.BCEWithLogitsLoss()
+
+    best_f1, best_metrics, patience_counter = -1.0, None, 0
+    for epoch in range(num_epochs):
+        model.train()
+        epoch_start_time = time.time()
+        total_loss = 0.0
+        order = rng.permutation(len(encoded))
+        for start in range(0, len(encoded), batch_size):
+            batch_idx = order[start:start + batch_size]
+            ids = torch.tensor([i for j in batch_idx for i in encoded[j]], dtype=torch.long)
+            offsets = torch.tensor(np.concatenate([[0], np.cumsum([len(encoded[j]) for j in batch_idx])[:-1]]), dtype=torch.long)
+            loss = criterion(model(ids, offsets), torch.from_numpy(targets[batch_idx]))
+
+            sparse_optimizer.zero_grad()
+            dense_optimizer.zero_grad()
+            loss.backward()
+            sparse_optimizer.step()
+            dense_optimizer.step()
+            total_loss += loss.item() * len(batch_idx)
+
+        val_metrics = evaluate_student(model, val_comments, val_labels)
+        print(f"Epoch {epoch + 1}/{num_epochs}, Train Loss: {total_loss / len(encoded):.4f}, Val Loss: {val_metrics['Loss']:.4f}, "
+              f"Val F1: {val_metrics['F1 Score']:.4f}, Val MCC: {val_metrics['MCC']:.4f}, Time: {time.time() - epoch_start_time:.1f}s")
+
+        if val_metrics['F1 Score'] > best_f1:
+            best_f1, best_metrics, patience_counter = val_metrics['F1 Score'], val_metrics, 0
+            model.save(output_dir, teacher=teacher, parameters=model.num_parameters(), best_epoch=epoch + 1, val_metrics=best_metrics)
+        else:
+            patience_counter += 1
+            if patience_counter >= early_stopping_patience:
+                print("Early stopping triggered.")
+                break
+    print(f"Student saved to {output_dir} (Val F1 {best_f1:.4f})")
+    return best_metrics
+
+
+def benchmark(model_names, val_data, num_items=2000, batch_size=64, output_path=None):
+    """Function to compare models on validation accuracy and CPU scoring throughput (items/sec)."""
+    comments, labels = _load_labelled(val_data)
+    # Throughput is measured on the validation comments, repeated to num_items
+    timing_comments = (comments * (num_items // max(len(comments), 1) + 1))[:num_items]
+
+    rows = []
+    for model_name in model_names:
+        _, model_path, model_base = find_model(model_name)
+        tokenizer, model = inference.load_model_and_tokenizer(model_path, model_base)
+        inference.predict_probabilities(tokenizer, model, timing_comments[:batch_size], batch_size)  # Warm-up
+
+        start = time.perf_counter()
+        inference.predict_probabilities(tokenizer, model, timing_comments, batch_size)
+        items_per_second = len(timing_comments) / (time.perf_counter() - start)
+
+        probabilities = inference.predict_probabilities(tokenizer, model, comments, batch_size)
+        metrics = compute_metrics(labels, (probabilities > inference.THRESHOLD).astype(int), float('nan'))
+        row = {'Model': model_name, 'Parameters': sum(p.numel() for p in model.parameters()), 'Items/sec': items_per_second}
+        row.update({name: value for name, value in metrics.items() if name != 'Loss'})
+        rows.append(row)
+        print(f"{model_name}: {items_per_second:.1f} items/sec, F1 {metrics['F1 Score']:.4f}, MCC {metrics['MCC']:.4f}")
+        del model
+
+    results = pd.DataFrame(rows)
+    if output_path:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        results.to_csv(output_path, index=False)
+    print(results.to_string(index=False))
+    return results
+
+
+def main():
+    default_comments = os.path.join(REPO_DIR, 'ToxicCommentCollectionCode', 'Data_Collection', 'comments.csv')
+    default_soft_labels = os.path.join(DEFAULT_OUTPUT_DIR, 'soft_labels.csv')
+    student_name, student_path, _ = find_model(STUDENT_MODEL)
+    teacher_name = TEACHER_MODEL
+
+    parser = argparse.ArgumentParser(description="Distil a fine-tuned transformer into a fastText-style student.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    label = subparsers.add_parser('label', help="Soft-label the unlabelled corpus with the teacher")
+    label.add_argument('--comments', default=default_comments)
+    label.add_argument('--teacher', default=teacher_name)
+    label.add_argument('--output', default=default_soft_labels)
+    label.add_argument('--batch-size', type=int, default=64)
+
+    train = subparsers.add_parser('train', help="Train the student on the soft labels")
+    train.add_argument('--soft-labels', default=default_soft_labels)
+    train.add_argument('--val', required=True, help="Labelled validation CSV with 'comment' and 'isToxic' columns")
+    train.add_argument('--train', help="Labelled training CSV added with hard labels")
+    train.add_argument('--teacher', default=teacher_name)
+    train.add_argument('--output-dir', default=student_path)
+    train.add_argument('--embedding-dim', type=int, default=64)
+    train.add_argument('--buckets', type=int, default=2 ** 18, help="Hashed feature buckets, the embedding has buckets x dim parameters")
+    train.add_argument('--epochs', type=int, default=10)
+    train.add_argument('--batch-size', type=int, default=64)
+    train.add_argument('--lr', type=float, default=0.05)
+
+    bench = subparsers.add_parser('benchmark', help="Compare accuracy and items/sec of models_validation entries")
+    bench.add_argument('--val', required=True)
+    bench.add_argument('--models', nargs='+', default=[teacher_name, student_name])
+    bench.add_argument('--items', type=int, default=2000)
+    bench.add_argument('--batch-size', type=int, default=64)
+    bench.add_argument('--output', default=os.path.join(DEFAULT_OUTPUT_DIR, 'distillation_benchmark.csv'))
+    args = parser.parse_args()
+
+    if args.command == 'label':
+        soft_label_corpus(args.comments, args.output, args.teacher, args.batch_size)
+    elif args.command == 'train':
+        train_student(args.soft_labels, args.val, args.output_dir, train_data=args.train, teacher=args.teacher,
+                      embedding_dim=args.embedding_dim, num_buckets=args.buckets, num_epochs=args.epochs,
+                      batch_size=args.batch_size, learning_rate=args.lr)
+    else:
+        benchmark(args.models, args.val, args.items, args.batch_size, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def pad_to_batch_max(batch, pad_token_id):
+    """Collate function padding every example only up to the longest sequence in the batch."""
+    batch_max_length = max(len(ids) for ids, _ in batch)
+    input_ids = torch.full((len(batch), batch_max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), batch_max_length), dtype=torch.long)
+    for i, (ids, _) in enumerate(batch):
+        input_ids[i, :len(ids)] = ids
+        attention_mask[i, :len(ids)] = 1
+    target = torch.tensor([label for _, label in batch])
+    return input_ids, attention_mask, target
+
+
+class BucketBatchSampler(Sampler):
+    """Batch sampler grouping sequences of similar length to minimise padding.
+
+    Indices are shuffled and split into buckets of batch_size * bucket_size_multiplier examples.
+    Each bucket is sorted by length and cut into batches, and the order of all batches is then
+    shuffled again, so batches differ between epochs while staying length-homogeneous.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size_multiplier=100, shuffle=True, drop_last=False, seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def _batches(self):
+        if self.shuffle:
+            indices = self.rng.permutation(len(self.lengths))
+        else:
+            indices = np.arange(len(self.lengths))
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start:start + self.bucket_size]
+            # Stable sort keeps the shuffled order among sequences of equal length
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batch = bucket[batch_start:batch_start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(min(self.bucket_size, len(self.lengths) - start) // self.batch_size
+                       for start in range(0, len(self.lengths), self.bucket_size))
+        return sum(-(-min(self.bucket_size, len(self.lengths) - start) // self.batch_size)
+                   for start in range(0, len(self.lengths), self.bucket_size))
+
+
+class ThroughputMeter:
+    """Tracks tokens/sec and the padding avoided compared with padding every example to max_length."""
+
+    def __init__(self, max_length=128):
+        self.max_length = max_length
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.num_examples = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def update(self, attention_mask):
+        self.num_examples += attention_mask.size(0)
+        self.real_tokens += int(attention_mask.sum().item())
+        self.padded_tokens += attention_mask.numel()
+
+    def summary(self, elapsed=None):
+        if elapsed is None:
+            elapsed = time.time() - self.start_time
+        elapsed = max(elapsed, 1e-9)
+        # Pad tokens the previous padding="max_length" path would have processed for the same examples
+        max_length_padding = self.num_examples * self.max_length - self.real_tokens
+        dynamic_padding = self.padded_tokens - self.real_tokens
+        padding_avoided = 1.0 - dynamic_padding / max_length_padding if max_length_padding > 0 else 0.0
+        return {
+            'tokens_per_sec': self.real_tokens / elapsed,
+            'padded_tokens_per_sec': self.padded_tokens / elapsed,
+            'padding_fraction': dynamic_padding / self.padded_tokens if self.padded_tokens else 0.0,
+            'padding_avoided': padding_avoided,
+        }
+
+    def report(self, elapsed=None):
+        stats = self.summary(elapsed)
+        return (f"Tokens/sec: {stats['tokens_per_sec']:.0f} (incl. padding: {stats['padded_tokens_per_sec']:.0f}), "
+                f"Padding: {stats['padding_fraction']:.2%} of processed tokens, "
+                f"Padding avoided vs max_length={self.max_length}: {stats['padding_avoided']:.2%}")
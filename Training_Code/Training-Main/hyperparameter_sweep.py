@@ -0,0 +1,315 @@
+import os
+import json
+import math
+import hashlib
+import argparse
+import itertools
+import traceback
+import multiprocessing as mp
+from concurrent.futures import as_completed
+import numpy as np
+import pandas as pd
+from worker_pool import plan_workers, pinned_pool, worker_threads
+import cross_validation
+
+# Values the notebooks used or varied between cells
+DEFAULT_SEARCH_SPACE = {
+    'learning_rate': [1e-5, 2e-5, 3e-5, 5e-5],
+    'batch_size': [8, 16, 32],
+    'max_length': [64, 128],
+    'early_stopping_patience': [2, 3, 4],
+}
+
+# Metrics where a lower value is better, all others are maximised
+MINIMISED_METRICS = {'Loss'}
+
+
+def trial_manifest(params, model_name, pretrained_model_path, data_hashes, settings):
+    """What a trial's results depend on, its hash names the trial directory so a changed trial is never reused."""
+    manifest = {
+        'params': params,
+        'model_name': model_name,
+        'pretrained_model_path': pretrained_model_path,
+        'train_sha256': data_hashes[0],
+        'val_sha256': data_hashes[1],
+        'settings': settings,
+    }
+    # Round-trip through JSON so the manifest compares equal to the stored one
+    return json.loads(json.dumps(manifest, sort_keys=True))
+
+
+def trial_key(manifest):
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def grid_trials(search_space):
+    """Function to enumerate every combination of the search space."""
+    names = list(search_space)
+    return [dict(zip(names, values)) for values in itertools.product(*(search_space[name] for name in names))]
+
+
+def random_trials(search_space, num_trials, seed=42):
+    """Function to sample distinct random combinations of the search space."""
+    trials = grid_trials(search_space)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(trials))[:num_trials]
+    return [trials[i] for i in order]
+
+
+class TrialPruner:
+    """Decides after every epoch whether a trial is losing and should stop, based on the other trials so far.
+
+    'median' stops a trial whose best score is worse than the median best score of the other trials at the
+    same epoch. 'halving' is asynchronous successive halving: at rung epochs min_epochs * eta^k a trial only
+    continues if it is in the top 1/eta of the trials that reached that rung. Scores are shared between worker
+    processes through a multiprocessing Manager dict.
+    """
+
+    def __init__(self, shared_scores, lock, method='median', metric='Loss', min_epochs=1, eta=3, min_trials=3):
+        self.shared_scores = shared_scores
+        self.lock = lock
+        self.method = method
+        self.metric = metric
+        self.min_epochs = min_epochs
+        self.eta = eta
+        self.min_trials = min_trials
+
+    def score(self, val_metrics):
+        # Scores are always minimised
+        value = val_metrics[self.metric]
+        return value if self.metric in MINIMISED_METRICS else -value
+
+    def is_rung(self, epoch):
+        if epoch < self.min_epochs:
+            return False
+        rung = math.log(epoch / self.min_epochs, self.eta)
+        return abs(rung - round(rung)) < 1e-9
+
+    def records(self, epoch):
+        # Median pruning compares trials at every epoch, halving only at its rungs
+        if self.method == 'none' or epoch < self.min_epochs:
+            return False
+        return self.method != 'halving' or self.is_rung(epoch)
+
+    def _record(self, trial_id, epoch, best_score):
+        with self.lock:
+            scores = dict(self.shared_scores.get(epoch, {}))
+            scores[trial_id] = best_score
+            self.shared_scores[epoch] = scores
+        return scores
+
+    def seed(self, trial_id, val_history):
+        """Record the per-epoch validation metrics of a trial completed by an earlier run, so resumed trials are compared to it."""
+        best_score = float('inf')
+        for epoch, val_metrics in enumerate(val_history, start=1):
+            best_score = min(best_score, self.score(val_metrics))
+            if self.records(epoch):
+                self._record(trial_id, epoch, best_score)
+
+    def should_stop(self, trial_id, epoch, best_score):
+        if not self.records(epoch):
+            return False
+
+        scores = self._record(trial_id, epoch, best_score)
+
+        others = [score for other_id, score in scores.items() if other_id != trial_id]
+        if self.method == 'median':
+            return len(others) >= self.min_trials and best_score > float(np.median(others))
+        # Successive halving: keep the top 1/eta of the trials seen at this rung
+        if len(scores) < self.eta:
+            return False
+        keep = max(1, len(scores) // self.eta)
+        return best_score > sorted(scores.values())[keep - 1]
+
+
+def read_val_history(directory):
+    """Function to read the per-epoch validation metrics a trial saved to metrics.csv."""
+    from training_engine import METRIC_NAMES
+
+    path = os.path.join(directory, 'metrics.csv')
+    if not os.path.isfile(path):
+        return []
+    history = pd.read_csv(path)
+    return [{name: float(row[f'Val {name}']) for name in METRIC_NAMES} for _, row in history.iterrows()]
+
+
+def run_trial(trial):
+    """Train one trial in its own directory, reporting every epoch to the pruner."""
+    from training_engine import train_and_evaluate_model
+
+    pruner = trial['pruner']
+    best_score = [float('inf')]
+
+    def epoch_callback(epoch, train_metrics, val_metrics):
+        best_score[0] = min(best_score[0], pruner.score(val_metrics))
+        if pruner.should_stop(trial['trial_id'], epoch, best_score[0]):
+            print(f"Pruning trial {trial['trial_id']} at epoch {epoch}")
+            return True
+        return False
+
+    directory = trial['trial_dir']
+    os.makedirs(directory, exist_ok=True)
+    cross_validation.write_json_atomic(os.path.join(directory, cross_validation.MANIFEST_FILE), trial['manifest'])
+    results = train_and_evaluate_model(
+        model_name=trial['model_name'],
+        pretrained_model_path=trial['pretrained_model_path'],
+        train_data=trial['train_path'],
+        val_data=trial['val_path'],
+        save_path=directory,
+        checkpoint_dir=directory,
+        num_threads=worker_threads(),
+        plot=False,
+        save_model=trial['save_models'],
+        epoch_callback=epoch_callback,
+        # Searched parameters override the fixed training arguments
+        **{**trial['train_kwargs'], **trial['params']},
+    )
+    # Trials are ranked on the epoch that is best for the sweep metric, which need not be the lowest-loss epoch
+    val_history = results['history']['val']
+    best_epoch = min(range(len(val_history)), key=lambda epoch: pruner.score(val_history[epoch]))
+    summary = {'Trial': trial['trial_id']}
+    summary.update(trial['params'])
+    summary.update({
+        'Best Epoch': best_epoch + 1,
+        'Checkpoint Epoch': results['best_epoch'],
+        'Epochs Run': len(results['val_losses']),
+        'Pruned': results['stopped_by_callback'],
+        'Train Time (s)': sum(results['epoch_times']),
+    })
+    summary.update({f'Val {name}': value for name, value in val_history[best_epoch].items()})
+
+    cross_validation.write_json_atomic(os.path.join(directory, cross_validation.RESULTS_FILE), summary)
+    return summary
+
+
+def run_sweep(model_name, train_path, val_path, output_dir, pretrained_model_path=None, search='random', num_trials=12,
+              search_space=None, metric='Loss', pruning=None, min_epochs=1, eta=3, num_workers=None, threads_per_job=None,
+              seed=42, save_models=False, **train_kwargs):
+    """Run a hyperparameter sweep around train_and_evaluate_model and return the trials ranked by metric.
+
+    search is 'grid', 'random' or 'halving' (random trials pruned by asynchronous successive halving).
+    Losing trials are stopped early from their per-epoch validation metrics ('median' pruning for grid and
+    random search by default). Every trial trains in trials/trial_<hash of its configuration>/, so completed
+    trials are skipped on restart and a changed search space or dataset never reuses stale results.
+    """
+    from training_engine import METRIC_NAMES
+
+    if metric not in METRIC_NAMES:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRIC_NAMES}")
+    search_space = search_space or DEFAULT_SEARCH_SPACE
+    if search == 'grid':
+        trials = grid_trials(search_space)
+    elif search in ('random', 'halving'):
+        trials = random_trials(search_space, num_trials, seed)
+    else:
+        raise ValueError(f"Unknown search '{search}', expected grid, random or halving")
+    if pruning is None:
+        pruning = 'halving' if search == 'halving' else 'median'
+    train_kwargs.setdefault('num_workers', 0)
+
+    ctx = mp.get_context('spawn')
+    manager = ctx.Manager()
+    pruner = TrialPruner(manager.dict(), manager.Lock(), pruning, metric, min_epochs, eta)
+
+    pretrained_model_path = pretrained_model_path or model_name
+    data_hashes = (cross_validation.file_sha256(train_path), cross_validation.file_sha256(val_path))
+    # Pruning decides how long a trial trains, so its settings are part of the trial configuration too
+    settings = dict(train_kwargs, metric=metric, pruning=pruning, min_epochs=min_epochs, eta=eta, save_models=save_models)
+    jobs = []
+    trial_dirs = []
+    for params in trials:
+        manifest = trial_manifest(params, model_name, pretrained_model_path, data_hashes, settings)
+        trial_id = trial_key(manifest)
+        trial_dir = os.path.join(output_dir, 'trials', f'trial_{trial_id}')
+        trial_dirs.append(trial_dir)
+        if cross_validation.is_completed(trial_dir, manifest):
+            print(f"Skipping trial {trial_id}: already completed.")
+            # Trials resumed after a restart are still pruned against the ones that finished before it
+            pruner.seed(trial_id, read_val_history(trial_dir))
+            continue
+        jobs.append({
+            'trial_id': trial_id,
+            'params': params,
+            'manifest': manifest,
+            'model_name': model_name,
+            'pretrained_model_path': pretrained_model_path,
+            'train_path': train_path,
+            'val_path': val_path,
+            'trial_dir': trial_dir,
+            'pruner': pruner,
+            'save_models': save_models,
+            'train_kwargs': train_kwargs,
+        })
+
+    if jobs:
+        num_workers, threads_per_job = plan_workers(len(jobs), num_workers, threads_per_job)
+        print(f"Running {len(jobs)} trials ({search} search, {pruning} pruning) on {num_workers} workers with {threads_per_job} threads each")
+
+        with pinned_pool(num_workers, threads_per_job, ctx) as executor:
+            futures = {executor.submit(run_trial, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    summary = future.result()
+                    status = 'pruned' if summary['Pruned'] else 'completed'
+                    print(f"Trial {job['trial_id']} {status}: {job['params']}, Val {metric} {summary[f'Val {metric}']:.4f}")
+                except Exception:
+                    print(f"Trial {job['trial_id']} failed, it will be retried on the next run:")
+                    traceback.print_exc()
+    manager.shutdown()
+
+    rows = []
+    for trial_dir in trial_dirs:
+        results_path = os.path.join(trial_dir, cross_validation.RESULTS_FILE)
+        if os.path.isfile(results_path):
+            with open(results_path, encoding='utf-8') as f:
+                rows.append(json.load(f))
+    results = pd.DataFrame(rows)
+    if not results.empty:
+        results = results.sort_values(f'Val {metric}', ascending=metric in MINIMISED_METRICS).reset_index(drop=True)
+        results.to_csv(os.path.join(output_dir, 'sweep_results.csv'), index=False)
+        print(results.to_string(index=False))
+    return results
+
+
+def main():
+    from training_engine import METRIC_NAMES
+
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep with early termination of losing trials.")
+    parser.add_argument('--model-name', required=True, help="Tokenizer name, e.g. MLRS/mBERTu")
+    parser.add_argument('--pretrained-model-path', help="Model to start from, defaults to --model-name")
+    parser.add_argument('--train', required=True)
+    parser.add_argument('--val', required=True)
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--search', choices=['grid', 'random', 'halving'], default='random')
+    parser.add_argument('--trials', type=int, default=12, help="Number of trials for random and halving search")
+    parser.add_argument('--search-space', help="JSON file mapping parameter names to lists of values")
+    parser.add_argument('--metric', default='Loss', choices=METRIC_NAMES, help="Validation metric to rank and prune trials on")
+    parser.add_argument('--pruning', choices=['none', 'median', 'halving'])
+    parser.add_argument('--min-epochs', type=int, default=1, help="Epochs before a trial can be pruned")
+    parser.add_argument('--eta', type=int, default=3, help="Successive halving reduction factor")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads-per-job', type=int)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--accumulation-steps', type=int, default=4)
+    parser.add_argument('--precision', choices=['auto', 'fp32', 'bf16', 'fp16'], default='auto')
+    parser.add_argument('--save-models', action='store_true', help="Save the best model of every trial")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    search_space = None
+    if args.search_space:
+        with open(args.search_space, encoding='utf-8') as f:
+            search_space = json.load(f)
+
+    run_sweep(
+        args.model_name, args.train, args.val, args.output_dir, pretrained_model_path=args.pretrained_model_path,
+        search=args.search, num_trials=args.trials, search_space=search_space, metric=args.metric,
+        pruning=args.pruning, min_epochs=args.min_epochs, eta=args.eta, num_workers=args.workers,
+        threads_per_job=args.threads_per_job, seed=args.seed, save_models=args.save_models,
+        num_epochs=args.epochs, accumulation_steps=args.accumulation_steps, precision=args.precision,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset
+
+# Default location of the cache, next to the '../../temp/' directory used for best_model.pth
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'temp', 'tokenization_cache')
+
+# Number of comments tokenized per call when building the cache
+TOKENIZE_CHUNK_SIZE = 10000
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """Function to compute the SHA-256 hash of a dataset file."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_key(dataset_hash, tokenizer_name, max_length, text_column='comment', label_column='isToxic'):
+    """Function to build the cache key for a (dataset, tokenizer, max_length) combination."""
+    key = json.dumps([dataset_hash, tokenizer_name, max_length, text_column, label_column])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def read_comments_and_labels(csv_path, text_column='comment', label_column='isToxic'):
+    """Function to read comments and labels, handling null values the same way as the training notebooks.
+
+    Parquet files exported by dataset_store.py are read column-wise with Arrow, skipping the pandas CSV parser.
+    """
+    if csv_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        table = pq.read_table(csv_path, columns=[text_column, label_column])
+        comments = table.column(text_column).fill_null('').to_pylist()
+        labels = table.column(label_column).fill_null(0).to_numpy().astype(np.int64)
+        return comments, labels
+    data = pd.read_csv(csv_path, usecols=[text_column, label_column])
+    comments = data[text_column].fillna('').astype(str).tolist()
+    labels = data[label_column].fillna(0).astype(np.int64).to_numpy()
+    return comments, labels
+
+
+def dataframe_comments_and_labels(data, text_column='comment', label_column='isToxic'):
+    """Function to read comments and labels from a DataFrame, handling null values like read_comments_and_labels."""
+    comments = data[text_column].fillna('').astype(str)
+    labels = data[label_column].fillna(0).astype(np.int64).to_numpy()
+    return comments, labels
+
+
+def dataframe_hash(comments, labels):
+    """Function to hash the content of a DataFrame's comments and labels, ignoring its index."""
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(comments, index=False).to_numpy().tobytes())
+    sha.update(np.ascontiguousarray(labels, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+
+def build_cache(csv_path, tokenizer, cache_path, max_length=128, text_column='comment', label_column='isToxic', metadata=None):
+    """Function to tokenize a CSV file once and store the variable-length token IDs as flat NumPy arrays."""
+    comments, labels = read_comments_and_labels(csv_path, text_column, label_column)
+    write_cache(comments, labels, tokenizer, cache_path, max_length, dict(metadata or {}, source=os.path.abspath(csv_path)))
+
+
+def write_cache(comments, labels, tokenizer, cache_path, max_length=128, metadata=None):
+    """Function to tokenize comments and write them with their labels as a cache directory."""
+    # Token IDs of all comments are concatenated, offsets[i]:offsets[i + 1] gives comment i
+    offsets = np.zeros(len(comments) + 1, dtype=np.int64)
+    id_chunks = []
+    for start in range(0, len(comments), TOKENIZE_CHUNK_SIZE):
+        encodings = tokenizer(comments[start:start + TOKENIZE_CHUNK_SIZE], truncation=True, max_length=max_length)
+        for i, ids in enumerate(encodings['input_ids']):
+            offsets[start + i + 1] = len(ids)
+        id_chunks.append(np.fromiter((token for ids in encodings['input_ids'] for token in ids), dtype=np.int32))
+    np.cumsum(offsets, out=offsets)
+    input_ids = np.concatenate(id_chunks) if id_chunks else np.zeros(0, dtype=np.int32)
+
+    # Write into a temporary directory first so concurrent runs never see a half-written cache
+    parent_dir = os.path.dirname(cache_path)
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.building-')
+    try:
+        np.save(os.path.join(tmp_dir, 'input_ids.npy'), input_ids)
+        np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+        np.save(os.path.join(tmp_dir, 'labels.npy'), labels)
+        meta = dict(metadata or {})
+        meta.update({
+            'num_examples': len(comments),
+            'num_tokens': int(offsets[-1]),
+            'max_length': max_length,
+            'pad_token_id': tokenizer.pad_token_id,
+        })
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.replace(tmp_dir, cache_path)
+        except OSError:
+            # Another run finished building the same cache first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+class CachedTokenizedDataset(Dataset):
+    """Dataset serving variable-length token IDs from a memory-mapped tokenization cache."""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.pad_token_id = self.meta['pad_token_id']
+        self.max_length = self.meta['max_length']
+        self._arrays = None
+
+    def _open(self):
+        # Arrays are opened lazily so DataLoader workers map the files instead of receiving pickled copies
+        if self._arrays is None:
+            self._arrays = tuple(
+                np.load(os.path.join(self.cache_path, f'{name}.npy'), mmap_mode='r')
+                for name in ('input_ids', 'offsets', 'labels')
+            )
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    def __getitem__(self, idx):
+        input_ids, offsets, labels = self._open()
+        ids = torch.from_numpy(np.array(input_ids[offsets[idx]:offsets[idx + 1]], dtype=np.int64))
+        return ids, int(labels[idx])
+
+    @property
+    def lengths(self):
+        """Token length of every example, read from the offsets without touching the token IDs."""
+        return np.diff(self._open()[1])
+
+    @property
+    def labels(self):
+        return np.asarray(self._open()[2])
+
+
+class TokenizedListDataset(Dataset):
+    """In-memory counterpart of CachedTokenizedDataset for DataFrames that have no file to key a cache on."""
+
+    def __init__(self, input_ids, labels, pad_token_id, max_length):
+        self.input_ids = [torch.tensor(ids, dtype=torch.long) for ids in input_ids]
+        self.labels = np.asarray(labels)
+        self.lengths = np.array([len(ids) for ids in input_ids])
+        self.pad_token_id = pad_token_id
+        self.max_length = max_length
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, idx):
+        return self.input_ids[idx], int(self.labels[idx])
+
+
+def tokenize_dataframe(data, tokenizer, max_length=128, text_column='comment', label_column='isToxic'):
+    """Function to tokenize a DataFrame without padding, returning a dataset with the same interface as the cache."""
+    comments, labels = dataframe_comments_and_labels(data, text_column, label_column)
+    encodings = tokenizer(comments.tolist(), truncation=True, max_length=max_length)
+    return TokenizedListDataset(encodings['input_ids'], labels, tokenizer.pad_token_id, max_length)
+
+
+def get_tokenized_dataset(csv_path, tokenizer, tokenizer_name, max_length=128, cache_dir=DEFAULT_CACHE_DIR, text_column='comment', label_column='isToxic'):
+    """Function to load a tokenized dataset from the cache, tokenizing the CSV file only on a cache miss."""
+    dataset_hash = file_hash(csv_path)
+    key = cache_key(dataset_hash, tokenizer_name, max_length, text_column, label_column)
+    cache_path = os.path.join(cache_dir, key)
+
+    if not os.path.isfile(os.path.join(cache_path, 'meta.json')):
+        print(f"Tokenization cache miss for {csv_path} ({tokenizer_name}, max_length={max_length}). Tokenizing...")
+        build_cache(csv_path, tokenizer, cache_path, max_length, text_column, label_column, metadata={
+            'dataset_hash': dataset_hash,
+            'tokenizer_name': tokenizer_name,
+        })
+    else:
+        print(f"Tokenization cache hit for {csv_path} ({tokenizer_name}, max_length={max_length}).")
+
+    return CachedTokenizedDataset(cache_path)
+
+
+def get_tokenized_dataframe(data, tokenizer, tokenizer_name, max_length=128, cache_dir=DEFAULT_CACHE_DIR, text_column='comment', label_column='isToxic'):
+    """Function to load a tokenized DataFrame from the cache, keyed on a hash of its comments and labels.
+
+    DataFrames read from the same CSV (and cleaned the same way) hit the same cache entry on every run.
+    """
+    comments, labels = dataframe_comments_and_labels(data, text_column, label_column)
+    dataset_hash = dataframe_hash(comments, labels)
+    key = cache_key(dataset_hash, tokenizer_name, max_length, text_column, label_column)
+    cache_path = os.path.join(cache_dir, key)
+
+    if not os.path.isfile(os.path.join(cache_path, 'meta.json')):
+        print(f"Tokenization cache miss for a DataFrame of {len(comments)} rows ({tokenizer_name}, max_length={max_length}). Tokenizing...")
+        write_cache(comments.tolist(), labels, tokenizer, cache_path, max_length, metadata={
+            'dataset_hash': dataset_hash,
+            'tokenizer_name': tokenizer_name,
+            'source': 'DataFrame',
+        })
+    else:
+        print(f"Tokenization cache hit for a DataFrame of {len(comments)} rows ({tokenizer_name}, max_length={max_length}).")
+
+    return CachedTokenizedDataset(cache_path)
+
+
+def pad_to_max_length(batch, pad_token_id, max_length=128):
+    """Collate function padding every example to max_length, matching tokenizer(padding="max_length")."""
+    input_ids = torch.full((len(batch), max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), max_length), dtype=torch.long)
+    for i, (ids, _) in enumerate(batch):
+        input_ids[i, :len(ids)] = ids
+        attention_mask[i, :len(ids)] = 1
+    target = torch.tensor([label for _, label in batch])
+    return input_ids, attention_mask, target
@@ -0,0 +1,431 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import tempfile
+from contextlib import nullcontext
+from functools import partial
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, matthews_corrcoef
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, get_linear_schedule_with_warmup
+from tokenization_cache import get_tokenized_dataset, get_tokenized_dataframe, pad_to_max_length
+from dynamic_batching import BucketBatchSampler, ThroughputMeter, pad_to_batch_max
+
+# instrumentation.py lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from instrumentation import torch_profile
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+METRIC_NAMES = ['Loss', 'Accuracy', 'F1 Score', 'Precision', 'Recall', 'MCC']
+
+
+def cpu_supports_bf16():
+    """Function to check whether the CPU has native bfloat16 support (AVX512-BF16 or AMX)."""
+    checks = [getattr(torch.cpu, name, None) for name in ('_is_avx512_bf16_supported', '_is_amx_tile_supported')]
+    return any(check() for check in checks if check is not None)
+
+
+def resolve_precision(precision):
+    """Function to pick the autocast dtype: 'auto' uses bf16 on supporting CPUs and fp16 on CUDA."""
+    if precision == 'auto':
+        if device.type == 'cuda':
+            return 'fp16'
+        return 'bf16' if cpu_supports_bf16() else 'fp32'
+    if precision not in ('fp32', 'bf16', 'fp16'):
+        raise ValueError(f"Unknown precision '{precision}', expected one of auto, fp32, bf16, fp16")
+    if precision == 'fp16' and device.type != 'cuda':
+        raise ValueError("fp16 autocast is only supported on CUDA, use bf16 on CPU")
+    return precision
+
+
+def autocast_context(precision):
+    if precision == 'fp32':
+        return nullcontext()
+    dtype = torch.bfloat16 if precision == 'bf16' else torch.float16
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def set_cpu_threads(num_threads=None, num_interop_threads=None):
+    """Function to control the intra-op and inter-op thread pools used by PyTorch on CPU."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work has started
+            print("Inter-op thread count already fixed for this process, ignoring num_interop_threads.")
+
+
+def compute_metrics(targets, predictions, loss):
+    """Function to compute the per-epoch metrics logged by the training notebooks."""
+    targets = np.asarray(targets).ravel()
+    predictions = np.asarray(predictions).ravel()
+    return {
+        'Loss': loss,
+        'Accuracy': accuracy_score(targets, predictions),
+        'F1 Score': f1_score(targets, predictions, average='weighted', zero_division=0),
+        'Precision': precision_score(targets, predictions, average='weighted', zero_division=0),
+        'Recall': recall_score(targets, predictions, average='weighted', zero_division=0),
+        'MCC': matthews_corrcoef(targets, predictions),
+    }
+
+
+def build_dataloaders(tokenizer, model_name, train_data, val_data, batch_size, max_length=128, dynamic_padding=True, num_workers=0):
+    """Function to build the train and validation DataLoaders from CSV paths or DataFrames, both through the tokenization cache."""
+    if isinstance(train_data, str):
+        train_dataset = get_tokenized_dataset(train_data, tokenizer, model_name, max_length)
+    else:
+        train_dataset = get_tokenized_dataframe(train_data, tokenizer, model_name, max_length)
+    if isinstance(val_data, str):
+        val_dataset = get_tokenized_dataset(val_data, tokenizer, model_name, max_length)
+    else:
+        val_dataset = get_tokenized_dataframe(val_data, tokenizer, model_name, max_length)
+
+    loader_args = dict(num_workers=num_workers, pin_memory=device.type == 'cuda')
+    if dynamic_padding:
+        collate_fn = partial(pad_to_batch_max, pad_token_id=tokenizer.pad_token_id)
+        train_dataloader = DataLoader(train_dataset, batch_sampler=BucketBatchSampler(train_dataset.lengths, batch_size), collate_fn=collate_fn, **loader_args)
+        val_dataloader = DataLoader(val_dataset, batch_sampler=BucketBatchSampler(val_dataset.lengths, batch_size, shuffle=False), collate_fn=collate_fn, **loader_args)
+    else:
+        collate_fn = partial(pad_to_max_length, pad_token_id=tokenizer.pad_token_id, max_length=max_length)
+        train_dataloader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn, **loader_args)
+        val_dataloader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, collate_fn=collate_fn, **loader_args)
+    return train_dataloader, val_dataloader
+
+
+def evaluate(model, dataloader, criterion, precision='fp32'):
+    """Function to run the validation step, returning the mean loss, predictions and targets."""
+    model.eval()
+    val_loss = 0.0
+    val_predictions = []
+    val_targets = []
+
+    with torch.no_grad():
+        for input_ids, attention_mask, target in dataloader:
+            input_ids, attention_mask, target = input_ids.to(device), attention_mask.to(device), target.to(device)
+            target = target.unsqueeze(1).float()
+
+            with autocast_context(precision):
+                outputs = model(input_ids, attention_mask=attention_mask)
+            logits = outputs.logits.float()
+            val_loss += criterion(logits, target).item()
+
+            val_predictions.append((torch.sigmoid(logits) > 0.5).int().cpu().numpy())
+            val_targets.append(target.cpu().numpy())
+
+    model.train()
+    return val_loss / max(1, len(dataloader)), np.vstack(val_predictions), np.vstack(val_targets)
+
+
+def save_metrics(history, save_path):
+    """Function to save the per-epoch train and validation metrics to metrics.csv."""
+    fieldnames = ['Epoch'] + [f'Train {name}' for name in METRIC_NAMES] + [f'Val {name}' for name in METRIC_NAMES]
+    metrics_filename = os.path.join(save_path, 'metrics.csv')
+    with open(metrics_filename, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for epoch, (train_metrics, val_metrics) in enumerate(zip(history['train'], history['val'])):
+            row = {'Epoch': epoch + 1}
+            row.update({f'Train {name}': train_metrics[name] for name in METRIC_NAMES})
+            row.update({f'Val {name}': val_metrics[name] for name in METRIC_NAMES})
+            writer.writerow(row)
+
+
+def plot_losses(results, save_path, show=False):
+    """Function to plot training and validation loss per epoch, highlighting the best epoch."""
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12, 8))
+    plt.plot(results['train_losses'], label='Training Loss', color='blue', linewidth=2, marker='o', markersize=5)
+    plt.plot(results['val_losses'], label='Validation Loss', color='orange', linewidth=2, marker='s', markersize=5)
+    best_epoch_idx = results['best_epoch']
+    plt.axvline(best_epoch_idx, linestyle='--', color='green', label='Best Epoch', linewidth=1.5)
+    plt.title(f"{results['model_name']} - Loss per Epoch", fontsize=20)
+    plt.xlabel('Epoch', fontsize=16)
+    plt.ylabel('Loss', fontsize=16)
+    plt.grid(True, linestyle='--', linewidth=0.5)
+    plt.legend(fontsize=14)
+    plt.tight_layout()
+    plt.savefig(os.path.join(save_path, 'training_graphs.png'))
+    if show:
+        plt.show()
+    plt.close()
+
+
+def train_and_evaluate_model(model_name, pretrained_model_path, tokenizer_class=AutoTokenizer, model_class=AutoModelForSequenceClassification,
+                             train_data=None, val_data=None, batch_size=16, save_path=None, max_length=128, accumulation_steps=4,
+                             early_stopping_patience=3, learning_rate=2e-5, weight_decay=0.01, num_epochs=50, dynamic_padding=True,
+                             precision='auto', compile_model=False, num_threads=None, num_interop_threads=None, num_workers=0,
+                             checkpoint_dir=None, plot=True, show_plots=False, save_model=True, epoch_callback=None,
+                             profile_dir=None, profile_epochs=1):
+    """Fine-tune a sequence classifier with a single logit and BCE loss, keeping the epoch with the lowest validation loss.
+
+    train_data and val_data are CSV paths or DataFrames with 'comment' and 'isToxic' columns, both tokenized
+    once through the tokenization cache (DataFrames are keyed on a hash of their content). The best model, metrics.csv and training_graphs.png are saved to save_path.
+    epoch_callback(epoch, train_metrics, val_metrics) is called after every epoch and stops training by returning True.
+    With profile_dir set, the training steps of the first profile_epochs epochs are captured with torch.profiler
+    and a Chrome trace per epoch is written to profile_dir.
+    """
+    set_cpu_threads(num_threads, num_interop_threads)
+    precision = resolve_precision(precision)
+    print(f"Training {model_name} on {device} with {precision} precision, {torch.get_num_threads()} threads")
+
+    tokenizer = tokenizer_class.from_pretrained(model_name)
+    train_dataloader, val_dataloader = build_dataloaders(tokenizer, model_name, train_data, val_data, batch_size,
+                                                         max_length, dynamic_padding, num_workers)
+
+    model = model_class.from_pretrained(pretrained_model_path, num_labels=1)
+    model.to(device)
+    # Dynamic padding gives every batch a different sequence length, compiling with dynamic shapes avoids a recompile per length
+    train_model = torch.compile(model, dynamic=True if dynamic_padding else None) if compile_model else model
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    criterion = nn.BCEWithLogitsLoss()
+    # Loss scaling is only needed for fp16, bf16 has the same exponent range as fp32
+    scaler = torch.cuda.amp.GradScaler() if precision == 'fp16' else None
+
+    total_batches = len(train_dataloader)
+    print_every = max(1, total_batches // 10)
+    num_training_steps = num_epochs * -(-total_batches // accumulation_steps)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_training_steps)
+
+    # Each run keeps its best checkpoint in its own directory so concurrent runs never overwrite each other
+    os.makedirs(save_path, exist_ok=True)
+    checkpoint_dir = checkpoint_dir or save_path
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    best_model_path = os.path.join(checkpoint_dir, 'best_model.pth')
+    # A checkpoint left by an interrupted run must never be loaded as this run's best model
+    if os.path.isfile(best_model_path):
+        os.remove(best_model_path)
+
+    history = {'train': [], 'val': []}
+    best_val_loss = float('inf')
+    best_epoch = None
+    early_stopping_counter = 0
+    stopped_by_callback = False
+    epoch_times = []
+    model.train()
+
+    for epoch in range(num_epochs):
+        epoch_start_time = time.time()
+        running_loss = 0.0
+        all_predictions = []
+        all_targets = []
+        throughput = ThroughputMeter(max_length)
+        optimizer.zero_grad()
+
+        # Only a few epochs are profiled, a trace of a whole run is too large to open
+        profiler = torch_profile(profile_dir) if profile_dir and epoch < profile_epochs else nullcontext()
+        with profiler:
+            for batch_idx, (input_ids, attention_mask, target) in enumerate(train_dataloader):
+                input_ids, attention_mask, target = input_ids.to(device), attention_mask.to(device), target.to(device)
+                target = target.unsqueeze(1).float()
+                throughput.update(attention_mask)
+
+                with autocast_context(precision):
+                    outputs = train_model(input_ids, attention_mask=attention_mask)
+                logits = outputs.logits.float()
+                loss = criterion(logits, target) / accumulation_steps
+
+                if scaler is not None:
+                    scaler.scale(loss).backward()
+                else:
+                    loss.backward()
+
+                if (batch_idx + 1) % accumulation_steps == 0 or (batch_idx + 1) == total_batches:
+                    if scaler is not None:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+                    scheduler.step()
+                    optimizer.zero_grad()
+
+                running_loss += loss.item() * accumulation_steps
+                all_predictions.append((torch.sigmoid(logits.detach()) > 0.5).int().cpu().numpy())
+                all_targets.append(target.cpu().numpy())
+
+                if batch_idx % print_every == 0:
+                    print(f"Epoch {epoch+1}, Batch {batch_idx+1}/{total_batches}: Loss: {loss.item() * accumulation_steps:.4f}")
+
+        epoch_time = time.time() - epoch_start_time
+        epoch_times.append(epoch_time)
+        train_metrics = compute_metrics(np.vstack(all_targets), np.vstack(all_predictions), running_loss / total_batches)
+
+        val_loss, val_predictions, val_targets = evaluate(train_model, val_dataloader, criterion, precision)
+        val_metrics = compute_metrics(val_targets, val_predictions, val_loss)
+
+        history['train'].append(train_metrics)
+        history['val'].append(val_metrics)
+
+        print(f"Epoch {epoch+1} completed in {epoch_time:.2f}s: " + ", ".join(f"{name}: {train_metrics[name]:.4f}" for name in METRIC_NAMES))
+        print("Validation " + ", ".join(f"{name}: {val_metrics[name]:.4f}" for name in METRIC_NAMES))
+        print(throughput.report(epoch_time))
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            best_epoch = epoch
+            early_stopping_counter = 0
+            torch.save(model.state_dict(), best_model_path)
+        else:
+            early_stopping_counter += 1
+
+        # The callback sees every epoch, including the one that triggers early stopping
+        if epoch_callback is not None and epoch_callback(epoch + 1, train_metrics, val_metrics):
+            print("Training stopped by epoch callback")
+            stopped_by_callback = True
+            break
+
+        # Early stopping check
+        if early_stopping_counter >= early_stopping_patience:
+            print("Early stopping triggered")
+            break
+
+        remaining_time = sum(epoch_times) / len(epoch_times) * (num_epochs - epoch - 1)
+        print(f"Estimated remaining time (without early stopping): {remaining_time:.2f}s")
+
+    if best_epoch is None:
+        raise RuntimeError(f"No epoch of {model_name} reached a finite validation loss (last: {history['val'][-1]['Loss']}), "
+                           "check the learning rate and precision")
+    print(f"Best epoch: {best_epoch + 1}, Best validation loss: {best_val_loss:.4f}")
+    print("Training completed.")
+
+    # Load the best model and save it
+    if save_model:
+        model.load_state_dict(torch.load(best_model_path, map_location=device))
+        model.save_pretrained(save_path)
+    os.remove(best_model_path)
+    save_metrics(history, save_path)
+
+    results = {
+        'model_name': model_name,
+        'train_losses': [metrics['Loss'] for metrics in history['train']],
+        'val_losses': [metrics['Loss'] for metrics in history['val']],
+        'train_accuracies': [metrics['Accuracy'] for metrics in history['train']],
+        'val_accuracies': [metrics['Accuracy'] for metrics in history['val']],
+        'history': history,
+        'best_epoch': best_epoch + 1,
+        'best_val_loss': best_val_loss,
+        'best_val_metrics': history['val'][best_epoch],
+        'epoch_times': epoch_times,
+        'stopped_by_callback': stopped_by_callback,
+    }
+    if plot:
+        plot_losses(results, save_path, show=show_plots)
+        print("Results and graphs saved.")
+    return results
+
+
+def smoke_test(work_dir=None, precision='auto', compile_model=False):
+    """Train a tiny randomly initialised BERT on random comments for two epochs, no GPU or downloads needed."""
+    import pandas as pd
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='training_engine_smoke_')
+    model_dir = os.path.join(work_dir, 'tiny-bert')
+    os.makedirs(model_dir, exist_ok=True)
+
+    words = ['il', 'kien', 'tajjeb', 'hazin', 'ħafna', 'mhux', 'dan', 'dik', 'int', 'aħna', 'huma', 'stupidu']
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words
+    vocab_file = os.path.join(model_dir, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(vocab))
+    BertTokenizerFast(vocab_file=vocab_file).save_pretrained(model_dir)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=64, num_labels=1)
+    BertForSequenceClassification(config).save_pretrained(model_dir)
+
+    rng = np.random.default_rng(0)
+    for split, size in (('train', 64), ('val', 16)):
+        comments = [' '.join(rng.choice(words, size=rng.integers(1, 20))) for _ in range(size)]
+        labels = [int('stupidu' in comment) for comment in comments]
+        pd.DataFrame({'comment': comments, 'isToxic': labels}).to_csv(os.path.join(work_dir, f'{split}.csv'), index=False)
+
+    results = train_and_evaluate_model(
+        model_name=model_dir,
+        pretrained_model_path=model_dir,
+        train_data=os.path.join(work_dir, 'train.csv'),
+        val_data=os.path.join(work_dir, 'val.csv'),
+        batch_size=8,
+        save_path=os.path.join(work_dir, 'output'),
+        max_length=32,
+        accumulation_steps=2,
+        num_epochs=2,
+        precision=precision,
+        compile_model=compile_model,
+        plot=False,
+    )
+    assert len(results['train_losses']) == 2 and np.isfinite(results['best_val_loss'])
+    assert os.path.isfile(os.path.join(work_dir, 'output', 'metrics.csv'))
+    print(f"Smoke test passed, outputs in {work_dir}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune a toxicity classifier on CPU or GPU.")
+    parser.add_argument('--model-name', help="Tokenizer name, e.g. MLRS/mBERTu")
+    parser.add_argument('--pretrained-model-path', help="Model to start from, defaults to --model-name")
+    parser.add_argument('--train', help="Training CSV with 'comment' and 'isToxic' columns")
+    parser.add_argument('--val', help="Validation CSV with 'comment' and 'isToxic' columns")
+    parser.add_argument('--save-path', help="Directory to save the best model, metrics and graphs")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--accumulation-steps', type=int, default=4)
+    parser.add_argument('--patience', type=int, default=3, help="Early stopping patience in epochs")
+    parser.add_argument('--lr', type=float, default=2e-5)
+    parser.add_argument('--weight-decay', type=float, default=0.01)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--precision', choices=['auto', 'fp32', 'bf16', 'fp16'], default='auto')
+    parser.add_argument('--compile', action='store_true', help="Compile the model with torch.compile")
+    parser.add_argument('--threads', type=int, help="Number of intra-op CPU threads")
+    parser.add_argument('--interop-threads', type=int, help="Number of inter-op CPU threads")
+    parser.add_argument('--num-workers', type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument('--static-padding', action='store_true', help="Pad every example to --max-length")
+    parser.add_argument('--profile-dir', help="Capture a torch.profiler trace of the first epochs into this directory")
+    parser.add_argument('--profile-epochs', type=int, default=1, help="Number of epochs to profile with --profile-dir")
+    parser.add_argument('--smoke-test', action='store_true', help="Train a tiny random model to validate the setup")
+    args = parser.parse_args()
+
+    if args.smoke_test:
+        set_cpu_threads(args.threads, args.interop_threads)
+        smoke_test(precision=args.precision, compile_model=args.compile)
+        return
+
+    if not (args.model_name and args.train and args.val and args.save_path):
+        parser.error("--model-name, --train, --val and --save-path are required unless --smoke-test is given")
+
+    train_and_evaluate_model(
+        model_name=args.model_name,
+        pretrained_model_path=args.pretrained_model_path or args.model_name,
+        train_data=args.train,
+        val_data=args.val,
+        batch_size=args.batch_size,
+        save_path=args.save_path,
+        max_length=args.max_length,
+        accumulation_steps=args.accumulation_steps,
+        early_stopping_patience=args.patience,
+        learning_rate=args.lr,
+        weight_decay=args.weight_decay,
+        num_epochs=args.epochs,
+        dynamic_padding=not args.static_padding,
+        precision=args.precision,
+        compile_model=args.compile,
+        num_threads=args.threads,
+        num_interop_threads=args.interop_threads,
+        num_workers=args.num_workers,
+        profile_dir=args.profile_dir,
+        profile_epochs=args.profile_epochs,
+    )
+
+
+if __name__ == "__main__":
+    main()
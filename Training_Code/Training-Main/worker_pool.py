@@ -0,0 +1,60 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in every worker process by init_worker
+_worker_threads = None
+
+
+def available_cpus():
+    """Function to count the CPU cores this process may run on."""
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+
+def core_slots_for(num_workers, threads_per_job):
+    """Function to split the available CPU cores into one disjoint slot per worker."""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    return [set(cores[i * threads_per_job:(i + 1) * threads_per_job]) for i in range(num_workers)]
+
+
+def init_worker(core_slots, threads_per_job):
+    """Pin each worker process to its own set of CPU cores and size its thread pools to match."""
+    global _worker_threads
+    cores = core_slots.get()
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    _worker_threads = threads_per_job
+
+    import torch
+    torch.set_num_threads(threads_per_job)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def worker_threads():
+    """Return the intra-op thread count of the current worker, None outside a pinned pool."""
+    return _worker_threads
+
+
+def plan_workers(num_jobs, num_workers=None, threads_per_job=None):
+    """Function to pick (num_workers, threads_per_job) so the workers share the cores without oversubscribing them."""
+    cpu_count = available_cpus()
+    num_workers = max(1, min(num_workers or 1, num_jobs, cpu_count))
+    threads_per_job = threads_per_job or max(1, cpu_count // num_workers)
+    return num_workers, threads_per_job
+
+
+def pinned_pool(num_workers, threads_per_job, ctx=None):
+    """Create a ProcessPoolExecutor whose workers each run on their own slot of CPU cores."""
+    # Spawn instead of fork so no worker inherits a half-initialised thread pool from the parent
+    ctx = ctx or mp.get_context('spawn')
+    core_slots = ctx.Queue()
+    for cores in core_slots_for(num_workers, threads_per_job):
+        core_slots.put(cores)
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=init_worker,
+                               initargs=(core_slots, threads_per_job))
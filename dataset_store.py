@@ -0,0 +1,241 @@
+"""Columnar Parquet storage for the comment datasets, replacing the chain of intermediate CSVs.
+
+Rows carry a stable row_id (the content hash of the comment), the label, a split assignment and their provenance
+(english, translated, scraped, manual, or augmented for the mixed shuffled_augmented_dataset.csv). Files are partitioned by split and provenance, so a read for the
+Maltese training split opens only those files, and only the requested columns are decoded.
+"""
+import os
+import uuid
+import hashlib
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Datasets', 'store')
+
+PROVENANCES = ('english', 'translated', 'scraped', 'manual', 'augmented')
+SPLITS = ('train', 'val', 'test', 'unassigned')
+
+# Columns stored inside the Parquet files, split and provenance come from the directory names
+FILE_SCHEMA = pa.schema([
+    ('row_id', pa.string()),
+    ('comment', pa.string()),
+    ('isToxic', pa.int8()),
+    ('reason', pa.string()),
+    ('source', pa.string()),
+    ('ingested_at', pa.timestamp('s')),
+])
+PARTITIONING = ds.partitioning(pa.schema([('split', pa.string()), ('provenance', pa.string())]), flavor='hive')
+SCHEMA = pa.schema(list(FILE_SCHEMA) + [('split', pa.string()), ('provenance', pa.string())])
+
+
+def row_id(comment):
+    """Stable row ID from the comment text, so the same comment gets the same ID in every source."""
+    return hashlib.sha256(str(comment).encode('utf-8')).hexdigest()[:16]
+
+
+def split_for(key, test_size=0.2, val_size=0.1, salt='split-v1'):
+    """Function to assign a split from a hash key, so a row keeps its split however the dataset grows.
+
+    The defaults match the notebook: 20% test, then 12.5% of the remaining 80% (10% overall) for validation.
+    """
+    position = int(hashlib.sha256(f'{salt}:{key}'.encode('utf-8')).hexdigest()[:15], 16) / 16 ** 15
+    if position < test_size:
+        return 'test'
+    if position < test_size + val_size:
+        return 'val'
+    return 'train'
+
+
+class DatasetStore:
+    """Append-only Parquet dataset of comments with split and provenance partitions."""
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def dataset(self):
+        return ds.dataset(self.root, format='parquet', schema=SCHEMA, partitioning=PARTITIONING)
+
+    def _filter(self, splits=None, provenance=None, where=None):
+        expression = where
+        for name, values in (('split', splits), ('provenance', provenance)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            condition = ds.field(name).isin(values)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def read(self, columns=None, splits=None, provenance=None, where=None):
+        """Read an Arrow table of the given columns, pruning partitions by split and provenance.
+
+        where is an extra pyarrow.dataset expression, e.g. ds.field('isToxic') == 1, checked against the
+        Parquet row-group statistics before any data is decoded.
+        """
+        return self.dataset().to_table(columns=columns, filter=self._filter(splits, provenance, where))
+
+    def to_pandas(self, columns=None, splits=None, provenance=None, where=None):
+        return self.read(columns, splits, provenance, where).to_pandas()
+
+    def iter_batches(self, columns=None, splits=None, provenance=None, where=None, batch_size=10000):
+        """Stream record batches, e.g. to tokenize a split without loading it all at once."""
+        scanner = self.dataset().scanner(columns=columns, filter=self._filter(splits, provenance, where), batch_size=batch_size)
+        yield from scanner.to_batches()
+
+    def row_ids(self):
+        if not any(files for _, _, files in os.walk(self.root)):
+            return set()
+        return set(self.read(columns=['row_id']).column('row_id').to_pylist())
+
+    def append(self, df, provenance, source='', text_column='comment', label_column='isToxic', reason_column=None,
+               split=None, existing_ids=None):
+        """Append the rows of a DataFrame that are not stored yet, returning the number of rows written.
+
+        split is a split name, a column of df, or a function of the row_id; rows without one are 'unassigned'.
+        Rows with a missing or blank comment are dropped, they would all share the row_id of the empty string.
+        Pass existing_ids (a set updated in place) when appending many chunks, to avoid re-reading the row IDs.
+        """
+        if provenance not in PROVENANCES:
+            raise ValueError(f"Unknown provenance '{provenance}', expected one of {PROVENANCES}")
+        existing_ids = self.row_ids() if existing_ids is None else existing_ids
+
+        df = df[df[text_column].notna() & (df[text_column].astype(str).str.strip() != '')]
+        comments = df[text_column].astype(str)
+        rows = pd.DataFrame({'row_id': comments.map(row_id), 'comment': comments})
+        rows['isToxic'] = pd.array(df[label_column], dtype='Int8') if label_column in df.columns else pd.array([None] * len(df), dtype='Int8')
+        rows['reason'] = df[reason_column].astype('string') if reason_column else pd.array([None] * len(df), dtype='string')
+        rows['source'] = source
+        rows['ingested_at'] = pd.Timestamp.now().floor('s')
+        if callable(split):
+            rows['split'] = rows['row_id'].map(split)
+        elif split in df.columns:
+            rows['split'] = df[split].fillna('unassigned').astype(str).to_numpy()
+        else:
+            rows['split'] = split or 'unassigned'
+        rows['provenance'] = provenance
+
+        rows = rows[~rows['row_id'].isin(existing_ids)].drop_duplicates('row_id')
+        if rows.empty:
+            return 0
+        unknown = set(rows['split']) - set(SPLITS)
+        if unknown:
+            raise ValueError(f"Unknown splits {sorted(unknown)}, expected one of {SPLITS}")
+
+        table = pa.Table.from_pandas(rows, schema=SCHEMA, preserve_index=False)
+        ds.write_dataset(table, self.root, format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        existing_ids.update(rows['row_id'])
+        return len(rows)
+
+    def assign_splits(self, split, splits=('unassigned',), provenance=None):
+        """Move stored rows to the split given by split, returning the number of rows moved.
+
+        split is a split name, a {row_id: split} dict or a function of the row_id, e.g. split_for. Only the rows
+        currently in splits (by default the unassigned ones) and provenance are considered, rows a dict does
+        not mention keep their split. Their partition files are rewritten: the new files are written before the
+        old ones are removed, so an interrupted call leaves rows in both partitions rather than losing them.
+        """
+        expression = self._filter(splits, provenance)
+        fragments = list(self.dataset().get_fragments(filter=expression))
+        if not fragments:
+            return 0
+        table = self.dataset().to_table(filter=expression)
+        current = table.column('split').to_pylist()
+        if callable(split):
+            new = [split(key) for key in table.column('row_id').to_pylist()]
+        elif isinstance(split, dict):
+            new = [split.get(key, old) for key, old in zip(table.column('row_id').to_pylist(), current)]
+        else:
+            new = [split] * table.num_rows
+        unknown = set(new) - set(SPLITS)
+        if unknown:
+            raise ValueError(f"Unknown splits {sorted(unknown)}, expected one of {SPLITS}")
+
+        moved = sum(old != value for old, value in zip(current, new))
+        if moved:
+            table = table.set_column(table.schema.get_field_index('split'), 'split', pa.array(new, pa.string()))
+            ds.write_dataset(table, self.root, format='parquet', partitioning=PARTITIONING,
+                             basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                             existing_data_behavior='overwrite_or_ignore')
+            for fragment in fragments:
+                os.remove(fragment.path)
+        return moved
+
+    def import_csv(self, csv_path, provenance, text_column='comment', label_column='isToxic', reason_column=None,
+                   split=None, has_header=True, chunksize=100000):
+        """Function to stream a CSV into the store, e.g. the scraped comments.csv (no header) or a labelled dataset."""
+        existing_ids = self.row_ids()
+        names = None if has_header else [text_column]
+        written = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, header=0 if has_header else None, names=names):
+            written += self.append(chunk, provenance, os.path.basename(csv_path), text_column, label_column,
+                                   reason_column, split, existing_ids)
+        return written
+
+    def export(self, path, splits=None, provenance=None, columns=('comment', 'isToxic')):
+        """Write a subset as a single Parquet (or CSV) file, e.g. the training split for training_engine.py."""
+        table = self.read(list(columns), splits, provenance)
+        if path.endswith('.csv'):
+            table.to_pandas().to_csv(path, index=False)
+        else:
+            pq.write_table(table, path)
+        return table.num_rows
+
+    def summary(self):
+        """Row and toxic counts per split and provenance."""
+        table = self.read(columns=['split', 'provenance', 'isToxic'])
+        counts = table.group_by(['split', 'provenance']).aggregate([([], 'count_all'), ('isToxic', 'sum')]).to_pandas()
+        counts = counts.rename(columns={'count_all': 'rows', 'isToxic_sum': 'toxic'})
+        return counts[['split', 'provenance', 'rows', 'toxic']].sort_values(['split', 'provenance']).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parquet dataset store for the toxic comment datasets.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import', help="Append a CSV to the store")
+    importer.add_argument('csv')
+    importer.add_argument('--provenance', required=True, choices=PROVENANCES)
+    importer.add_argument('--text-column', default='comment')
+    importer.add_argument('--label-column', default='isToxic')
+    importer.add_argument('--reason-column')
+    importer.add_argument('--split', help="Split of every imported row, or the name of a split column")
+    importer.add_argument('--no-header', action='store_true', help="The CSV has one comment per row and no header, like comments.csv")
+
+    exporter = subparsers.add_parser('export', help="Write a subset to a Parquet or CSV file")
+    exporter.add_argument('output')
+    exporter.add_argument('--split', nargs='+')
+    exporter.add_argument('--provenance', nargs='+', choices=PROVENANCES)
+    exporter.add_argument('--columns', nargs='+', default=['comment', 'isToxic'])
+
+    assigner = subparsers.add_parser('assign-splits', help="Assign train/val/test splits to unassigned rows by hashing their row_id")
+    assigner.add_argument('--provenance', nargs='+', choices=PROVENANCES)
+    assigner.add_argument('--test-size', type=float, default=0.2)
+    assigner.add_argument('--val-size', type=float, default=0.1)
+    assigner.add_argument('--salt', default='split-v1')
+
+    subparsers.add_parser('summary', help="Print row counts per split and provenance")
+    args = parser.parse_args()
+
+    store = DatasetStore(args.store)
+    if args.command == 'import':
+        written = store.import_csv(args.csv, args.provenance, args.text_column, args.label_column, args.reason_column,
+                                   args.split, has_header=not args.no_header)
+        print(f"Appended {written} new rows from {args.csv}")
+    elif args.command == 'export':
+        rows = store.export(args.output, args.split, args.provenance, args.columns)
+        print(f"Wrote {rows} rows to {args.output}")
+    elif args.command == 'assign-splits':
+        moved = store.assign_splits(lambda key: split_for(key, args.test_size, args.val_size, args.salt), provenance=args.provenance)
+        print(f"Assigned splits to {moved} rows")
+    else:
+        print(store.summary().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from inference import model_key, load_model_and_tokenizer, predict_probabilities
+
+METRICS = ['Accuracy', 'F1 Score', 'Precision', 'Recall', 'MCC']
+
+# Number of resamples whose confusion counts are computed per matrix product, bounds memory use
+RESAMPLE_CHUNK_SIZE = 1000
+
+
+def confusion_counts(weights, labels, predictions):
+    """Function to compute (tn, fp, fn, tp) for many samples at once.
+
+    weights has one row per sample and one column per pool example, holding how often the example appears
+    in the sample (0/1 for subsets, multinomial counts for bootstrap resamples).
+    """
+    labels = np.asarray(labels).astype(bool)
+    predictions = np.asarray(predictions).astype(bool)
+    indicators = np.stack([~labels & ~predictions, ~labels & predictions, labels & ~predictions, labels & predictions], axis=1)
+    counts = np.asarray(weights, dtype=np.float64) @ indicators.astype(np.float64)
+    return counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3]
+
+
+def _safe_divide(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64), where=denominator > 0)
+
+
+def metrics_from_counts(tn, fp, fn, tp):
+    """Function to compute accuracy, weighted F1/precision/recall and MCC from confusion counts, matching sklearn."""
+    total = tn + fp + fn + tp
+    support_0 = tn + fp
+    support_1 = tp + fn
+
+    precision = (support_0 * _safe_divide(tn, tn + fn) + support_1 * _safe_divide(tp, tp + fp))
+    recall = (support_0 * _safe_divide(tn, tn + fp) + support_1 * _safe_divide(tp, tp + fn))
+    f1 = (support_0 * _safe_divide(2 * tn, 2 * tn + fn + fp) + support_1 * _safe_divide(2 * tp, 2 * tp + fp + fn))
+    mcc_denominator = np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+
+    return {
+        'Accuracy': _safe_divide(tp + tn, total),
+        'F1 Score': _safe_divide(f1, total),
+        'Precision': _safe_divide(precision, total),
+        'Recall': _safe_divide(recall, total),
+        'MCC': _safe_divide(tp * tn - fp * fn, mcc_denominator),
+    }
+
+
+class EvaluationEngine:
+    """Scores a labelled pool once per model and evaluates any number of subsets or resamples of it.
+
+    Subsets of the pool (such as subset1..5 of cleaned_manually_labelled_dataset.csv) are index arrays into
+    the pool, so their metrics are computed from the cached probability vector without running the model again.
+    """
+
+    def __init__(self, pool_path, text_column='comment', label_column='isToxic', batch_size=32, max_length=128, threshold=0.5, cache_dir=None):
+        self.pool_path = pool_path
+        data = pd.read_csv(pool_path)
+        self.comments = data[text_column].astype(str).tolist()
+        self.labels = data[label_column].astype(int).to_numpy()
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.threshold = threshold
+        self.cache_dir = cache_dir
+        self.probabilities = {}
+        with open(pool_path, 'rb') as f:
+            self.pool_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    def score_model(self, model_name, model_path, model_base):
+        """Load a model once and score the whole pool, reusing cached probabilities when available."""
+        if model_name in self.probabilities:
+            return self.probabilities[model_name]
+
+        cache_path = None
+        if self.cache_dir:
+            # model_key changes when the checkpoint is retrained in place, so stale probabilities are not served
+            identity = f'{os.path.abspath(model_path)}|{model_key(model_name, model_path)}|{self.pool_hash}|{self.max_length}'
+            key = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+            cache_path = os.path.join(self.cache_dir, f'{model_name}_{key}.npy')
+            if os.path.isfile(cache_path):
+                self.probabilities[model_name] = np.load(cache_path)
+                return self.probabilities[model_name]
+
+        tokenizer, model = load_model_and_tokenizer(model_path, model_base)
+        probabilities = predict_probabilities(tokenizer, model, self.comments, self.batch_size, self.max_length)
+        del model
+
+        if cache_path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.save(cache_path, probabilities)
+        self.probabilities[model_name] = probabilities
+        return probabilities
+
+    def score_models(self, models):
+        for model_name, model_path, model_base in models:
+            print(f"Scoring {len(self.comments)} comments with {model_name}...")
+            self.score_model(model_name, model_path, model_base)
+
+    def predictions(self, model_name):
+        return (self.probabilities[model_name] > self.threshold).astype(int)
+
+    def subset_indices(self, n_toxic, n_non_toxic, random_state):
+        """Function to sample a subset of the pool, selecting the same rows as the pandas sampling in testing_models.ipynb."""
+        toxic = pd.Series(np.flatnonzero(self.labels == 1)).sample(n_toxic, random_state=random_state)
+        non_toxic = pd.Series(np.flatnonzero(self.labels == 0)).sample(n_non_toxic, random_state=random_state)
+        return np.concatenate([toxic.to_numpy(), non_toxic.to_numpy()])
+
+    def indices_for_csv(self, csv_path, text_column='comment', label_column='isToxic'):
+        """Function to map the rows of a subset CSV (e.g. ./subset/subset1.csv) back to pool indices."""
+        positions = {}
+        for i, key in enumerate(zip(self.comments, self.labels)):
+            positions.setdefault(key, []).append(i)
+        subset = pd.read_csv(csv_path)
+        indices = []
+        for key in zip(subset[text_column].astype(str), subset[label_column].astype(int)):
+            if not positions.get(key):
+                raise ValueError(f"Row {key!r} of {csv_path} is not in the pool {self.pool_path}")
+            indices.append(positions[key].pop(0))
+        return np.array(indices)
+
+    def _weights(self, indices):
+        weights = np.zeros(len(self.labels), dtype=np.float64)
+        np.add.at(weights, indices, 1)
+        return weights
+
+    def evaluate(self, subsets, models=None):
+        """Evaluate every model on every subset, given as {subset name: pool indices} (None for the whole pool).
+
+        Returns a DataFrame with one row per (model, subset) holding the metrics and the confusion matrix.
+        """
+        models = models or list(self.probabilities)
+        names = list(subsets)
+        weights = np.stack([np.ones(len(self.labels)) if subsets[name] is None else self._weights(subsets[name]) for name in names])
+
+        rows = []
+        for model_name in models:
+            tn, fp, fn, tp = confusion_counts(weights, self.labels, self.predictions(model_name))
+            metrics = metrics_from_counts(tn, fp, fn, tp)
+            for i, name in enumerate(names):
+                row = {'Model': model_name, 'Subset': name}
+                row.update({metric: float(metrics[metric][i]) for metric in METRICS})
+                row['Confusion Matrix'] = np.array([[tn[i], fp[i]], [fn[i], tp[i]]], dtype=int)
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def bootstrap(self, model_name, n_resamples=10000, indices=None, confidence=0.95, seed=42):
+        """Bootstrap confidence intervals of every metric, resampling the pool (or a subset) with replacement."""
+        rng = np.random.default_rng(seed)
+        indices = np.arange(len(self.labels)) if indices is None else np.asarray(indices)
+        labels = self.labels[indices]
+        predictions = self.predictions(model_name)[indices]
+        uniform = np.full(len(indices), 1.0 / len(indices))
+
+        samples = {metric: [] for metric in METRICS}
+        for start in range(0, n_resamples, RESAMPLE_CHUNK_SIZE):
+            size = min(RESAMPLE_CHUNK_SIZE, n_resamples - start)
+            # Multinomial counts are equivalent to drawing len(indices) rows with replacement
+            weights = rng.multinomial(len(indices), uniform, size=size)
+            metrics = metrics_from_counts(*confusion_counts(weights, labels, predictions))
+            for metric in METRICS:
+                samples[metric].append(metrics[metric])
+
+        point = metrics_from_counts(*confusion_counts(np.ones((1, len(indices))), labels, predictions))
+        alpha = (1 - confidence) / 2
+        rows = []
+        for metric in METRICS:
+            values = np.concatenate(samples[metric])
+            rows.append({
+                'Model': model_name,
+                'Metric': metric,
+                'Value': float(point[metric][0]),
+                'Lower': float(np.quantile(values, alpha)),
+                'Upper': float(np.quantile(values, 1 - alpha)),
+                'Std': float(values.std()),
+            })
+        return pd.DataFrame(rows)
@@ -0,0 +1,201 @@
+"""Lightweight inference core shared by RunModels.py, the evaluation engine and the labelling tools.
+
+Importing this module is cheap: torch and transformers are only imported when the first model is loaded,
+so batch jobs and worker processes do not pay for the Gradio UI stack and start serving quickly.
+"""
+import os
+import sys
+import time
+from instrumentation import span, increment, metrics, torch_profile
+
+# Cross-validation models
+models_validation = [
+    ('BERT', './models/Experiments/Validation/Experiment-1/BERT_ENG', 'bert-base-uncased'),
+    ('XLMR', './models/Experiments/Validation/Experiment-1/XLM-R_ENG', 'xlm-roberta-base'),
+    ('RoBERTa' , './models/Experiments/Validation/Experiment-1/RoBERTa_ENG' , 'FacebookAI/roberta-base'),
+    ('mBERTu' , './models/Experiments/Validation/Experiment-1/mBERTu_ENG' , 'MLRS/mBERTu'),
+    ('BERT_FT', './models/Experiments/Validation/Experiment-2/BERT_FT', 'bert-base-uncased'),
+    ('XLMR_FT', './models/Experiments/Validation/Experiment-2/XLM-R_FT', 'xlm-roberta-base'),
+    ('RoBERTa_FT' , './models/Experiments/Validation/Experiment-2/RoBERTa_FT' , 'FacebookAI/roberta-base'),
+    ('mBERTu_FT', './models/Experiments/Validation/Experiment-2/mBERTu_FT', 'MLRS/mBERTu'),
+    # Distilled from mBERTu_FT by Training_Code/Training-Main/distillation.py, it hashes its input and has no base tokenizer
+    ('mBERTu_FT_Student', './models/Experiments/Distillation/mBERTu_FT_Student', None),
+]
+
+# Modules that must not be imported by `import inference`
+HEAVY_MODULES = ['torch', 'transformers', 'gradio', 'PIL', 'numpy']
+
+THRESHOLD = 0.5
+
+# Files that change when a model is retrained. Tokenizer files are left out, `--export-tokenizer`
+# rewrites them without changing the scores
+CHECKPOINT_FILES = ('config.json', 'model.safetensors', 'pytorch_model.bin', 'student_config.json', 'student.pt')
+
+# Models loaded by get_model, keyed by model name
+_loaded_models = {}
+_device = None
+
+
+def get_device():
+    global _device
+    if _device is None:
+        import torch
+        _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return _device
+
+
+def find_model(model_choice):
+    """Return the (model_name, model_path, model_base) entry of models_validation for a model name."""
+    for model in models_validation:
+        if model[0] == model_choice:
+            return model
+    raise ValueError(f"Unknown model '{model_choice}', expected one of {[model[0] for model in models_validation]}")
+
+
+def model_key(model_name, model_path):
+    """Function to identify a checkpoint, changing whenever the weights or config are retrained."""
+    files = [os.path.join(model_path, name) for name in CHECKPOINT_FILES if os.path.isfile(os.path.join(model_path, name))]
+    mtime = max((os.path.getmtime(f) for f in files), default=0)
+    size = sum(os.path.getsize(f) for f in files)
+    return f'{model_name}:{int(mtime)}:{size}'
+
+
+def load_model_and_tokenizer(model_path, model_name):
+    """Return (tokenizer, model), or (hasher, student) for a distilled student which needs no tokenizer."""
+    if os.path.isfile(os.path.join(model_path, 'student_config.json')):
+        with span('inference.load_model'):
+            from student_model import load_student
+            student = load_student(model_path)
+        return student.hasher, student
+
+    with span('inference.import'):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    with span('inference.load_model'):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        model.to(get_device())
+        model.eval()
+    return tokenizer, model
+
+
+def get_model(model_choice, model_path=None, model_base=None):
+    """Function to load a model once per process and reuse it for every prediction.
+
+    The path and base tokenizer are looked up in models_validation unless given.
+    """
+    if model_choice not in _loaded_models:
+        if model_path is None:
+            _, model_path, model_base = find_model(model_choice)
+        _loaded_models[model_choice] = load_model_and_tokenizer(model_path, model_base)
+    return _loaded_models[model_choice]
+
+
+def export_tokenizer(model_choice):
+    """Function to save the base tokenizer into a model's directory, so the directory can be loaded on its own.
+
+    Loading never writes into model directories, which may be read-only or shared by several worker processes.
+    """
+    _, model_path, model_base = find_model(model_choice)
+    if os.path.isfile(os.path.join(model_path, 'student_config.json')):
+        return None  # Students hash their input and have no tokenizer
+    from transformers import AutoTokenizer
+    AutoTokenizer.from_pretrained(model_base).save_pretrained(model_path)
+    return model_path
+
+
+def predict_probabilities(tokenizer, model, comments, batch_size=32, max_length=128):
+    """Function to score comments once, batching them by length so each batch is padded as little as possible."""
+    if getattr(model, 'is_student', False):
+        with span('inference.student'):
+            probabilities = model.predict_probabilities(list(comments), max(batch_size, 256))
+        increment('inference_texts', len(comments))
+        return probabilities
+
+    import numpy as np
+    import torch
+
+    with span('inference.tokenize'):
+        encodings = tokenizer(comments, truncation=True, max_length=max_length)
+        lengths = np.array([len(ids) for ids in encodings['input_ids']])
+        order = np.argsort(lengths, kind='stable')
+    probabilities = np.empty(len(comments), dtype=np.float32)
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            with span('inference.pad'):
+                batch = tokenizer.pad({'input_ids': [encodings['input_ids'][i] for i in batch_idx]}, return_tensors='pt')
+            with span('inference.forward'):
+                outputs = model(batch['input_ids'].to(get_device()), attention_mask=batch['attention_mask'].to(get_device()))
+            with span('inference.postprocess'):
+                probabilities[batch_idx] = torch.sigmoid(outputs.logits.float().view(-1)).cpu().numpy()
+    increment('inference_texts', len(comments))
+    return probabilities
+
+
+def label_for(probability, threshold=THRESHOLD):
+    return "Toxic" if probability > threshold else "Non-toxic"
+
+
+def classify_texts(texts, model_choice, batch_size=32, max_length=128, model_path=None, model_base=None):
+    """Return the toxicity probability of every text with the chosen model."""
+    tokenizer, model = get_model(model_choice, model_path, model_base)
+    return [float(p) for p in predict_probabilities(tokenizer, model, list(texts), batch_size, max_length)]
+
+
+def measure_import():
+    """Function to import this module in a fresh interpreter, returning (seconds taken, heavy modules imported)."""
+    import subprocess
+
+    code = (
+        "import sys, time; start = time.perf_counter(); import inference; elapsed = time.perf_counter() - start; "
+        f"print(elapsed); print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout.splitlines()
+    return float(output[0]), [m for m in output[1].split(',') if m] if len(output) > 1 else []
+
+
+def check_import_budget(budget):
+    """Function to check importing this module is fast and pulls in no heavy modules."""
+    elapsed, heavy = measure_import()
+    print(f"import inference took {elapsed * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    if heavy:
+        print(f"Heavy modules imported at load: {', '.join(heavy)}")
+    return elapsed <= budget and not heavy
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classify text as Toxic or Non-toxic from the command line.")
+    parser.add_argument('texts', nargs='*', help="Texts to classify")
+    parser.add_argument('--model', default='mBERTu_FT', choices=[model[0] for model in models_validation])
+    parser.add_argument('--profile-dir', help="Capture a torch.profiler trace of the predictions into this directory")
+    parser.add_argument('--metrics', help="Write stage timings to this file, JSON for .json and Prometheus text otherwise")
+    parser.add_argument('--export-tokenizer', action='store_true', help="Save the base tokenizer into the model's directory and exit")
+    parser.add_argument('--check-import-budget', type=float, metavar='SECONDS',
+                        help="Fail if importing this module takes longer than SECONDS or imports torch, transformers or gradio")
+    args = parser.parse_args()
+
+    if args.check_import_budget is not None:
+        sys.exit(0 if check_import_budget(args.check_import_budget) else 1)
+    if args.export_tokenizer:
+        model_path = export_tokenizer(args.model)
+        print(f"Tokenizer saved to {model_path}" if model_path else f"{args.model} has no tokenizer to export")
+        return
+
+    start = time.perf_counter()
+    with torch_profile(args.profile_dir):
+        probabilities = classify_texts(args.texts, args.model) if args.texts else []
+    for text, probability in zip(args.texts, probabilities):
+        print(f"{label_for(probability)}\t{probability:.4f}\t{text}")
+    print(f"Time to first prediction: {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    print(metrics.report(), file=sys.stderr)
+    if args.metrics:
+        metrics.write(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
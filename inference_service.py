@@ -0,0 +1,350 @@
+"""HTTP inference service for the toxicity models, alongside the Gradio demo in RunModels.py.
+
+Run with `python inference_service.py --models mBERTu_FT` (or `uvicorn inference_service:app`, configured with the
+SERVICE_* environment variables). Models are preloaded in a pool of worker processes, so the event loop only
+parses requests and streams results. Requests beyond the queue limit are rejected with 503 instead of piling up,
+which lets a load balancer send them to another replica.
+"""
+import os
+import json
+import asyncio
+import argparse
+import multiprocessing as mp
+from typing import List, Optional
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel
+import inference
+from instrumentation import metrics, span, increment
+
+NDJSON = 'application/x-ndjson'
+
+
+@dataclass
+class ServiceConfig:
+    models: list = field(default_factory=lambda: os.environ.get('SERVICE_MODELS', 'mBERTu_FT').split(','))
+    num_workers: int = int(os.environ.get('SERVICE_WORKERS', 1))
+    threads_per_worker: int = int(os.environ.get('SERVICE_THREADS_PER_WORKER', 0))
+    max_pending: int = int(os.environ.get('SERVICE_MAX_PENDING', 64))
+    max_batch_items: int = int(os.environ.get('SERVICE_MAX_BATCH_ITEMS', 1024))
+    max_text_chars: int = int(os.environ.get('SERVICE_MAX_TEXT_CHARS', 5000))
+    max_body_bytes: int = int(os.environ.get('SERVICE_MAX_BODY_BYTES', 2 * 1024 * 1024))
+    chunk_size: int = int(os.environ.get('SERVICE_CHUNK_SIZE', 32))
+
+
+class ClassifyRequest(BaseModel):
+    text: str
+    model: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    texts: List[str]
+    model: Optional[str] = None
+
+
+def _init_worker(models, threads, barrier):
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    for model_choice in models:
+        inference.classify_texts(["warmup"], model_choice)
+    # No worker takes a task before every worker has loaded and warmed all models, so the first tasks
+    # completing means the whole pool is warm
+    barrier.wait()
+
+
+def _handshake():
+    return metrics.drain()
+
+
+def _classify(model_choice, texts):
+    # The worker's spans (tokenize, forward, ...) go back with the result and are merged into the server's registry
+    return inference.classify_texts(texts, model_choice), metrics.drain()
+
+
+def _result(text_index, probability):
+    return {'index': text_index, 'label': inference.label_for(probability), 'probability': probability}
+
+
+def parse_ndjson(raw):
+    """Return the texts of an NDJSON body of {"text": ...} lines, raising ValueError with the failing line."""
+    texts = []
+    for number, line in enumerate(raw.decode('utf-8').splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {number} is not valid JSON")
+        if not isinstance(item, dict) or not isinstance(item.get('text'), str):
+            raise ValueError(f"Line {number} must be a JSON object with a 'text' string")
+        texts.append(item['text'])
+    return texts
+
+
+def check_models(models):
+    """Fail at startup on model names that are not in models_validation, instead of never becoming ready."""
+    valid = [model[0] for model in inference.models_validation]
+    unknown = [model for model in models if model not in valid]
+    if unknown or not models:
+        raise ValueError(f"Unknown models {unknown} in the service configuration, expected names from {valid}")
+
+
+class BodySizeLimit:
+    """ASGI middleware rejecting bodies over max_body_bytes, by Content-Length and while the body is received.
+
+    Chunked requests have no Content-Length, so the body is read here up to the limit and answered with a 413
+    as soon as it is passed. A body within the limit is handed to the app unchanged.
+    """
+
+    def __init__(self, app, max_body_bytes):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        length = dict(scope['headers']).get(b'content-length')
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                return await self._reject(scope, receive, send, 400, "Invalid Content-Length header")
+            if length > self.max_body_bytes:
+                return await self._reject(scope, receive, send, 413, f"Request body larger than {self.max_body_bytes} bytes")
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if len(body) > self.max_body_bytes:
+                return await self._reject(scope, receive, send, 413, f"Request body larger than {self.max_body_bytes} bytes")
+
+        replayed = False
+
+        async def replay_receive():
+            # The buffered body first, then the client's messages, e.g. a disconnect during a streamed response
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {'type': 'http.request', 'body': bytes(body), 'more_body': False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+    async def _reject(self, scope, receive, send, status_code, detail):
+        await JSONResponse({'detail': detail}, status_code=status_code)(scope, receive, send)
+
+
+def create_app(config=None):
+    config = config or ServiceConfig()
+    check_models(config.models)
+    state = {'pool': None, 'warmup': None, 'ready': False, 'pending': 0}
+
+    def start_pool():
+        """Start the worker pool and mark the service ready once every worker has loaded and warmed the models."""
+        state['ready'] = False
+        # Spawned workers do not inherit the event loop or CUDA state of the server process
+        ctx = mp.get_context('spawn')
+        barrier = ctx.Barrier(config.num_workers)
+        pool = ProcessPoolExecutor(max_workers=config.num_workers, mp_context=ctx, initializer=_init_worker,
+                                   initargs=(config.models, config.threads_per_worker, barrier))
+        state['pool'] = pool
+        loop = asyncio.get_running_loop()
+        # One task per worker starts every worker process. The tasks only run once all workers passed the barrier,
+        # and a worker failing to load its models breaks the pool, which fails them
+        handshakes = [loop.run_in_executor(pool, _handshake) for _ in range(config.num_workers)]
+        state['warmup'] = asyncio.ensure_future(asyncio.gather(*handshakes))
+
+        def warmed_up(task):
+            # Cancelled on shutdown, or by the pool's pending tasks being cancelled
+            if state['pool'] is not pool or task.cancelled() or isinstance(task.exception(), asyncio.CancelledError):
+                return
+            if task.exception() is not None:
+                print(f"Worker warmup failed, the service stays unready: {task.exception()!r}")
+                return
+            for snapshot in task.result():
+                metrics.merge(snapshot)
+            state['ready'] = True
+
+        state['warmup'].add_done_callback(warmed_up)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        start_pool()
+        yield
+        state['ready'] = False
+        state['warmup'].cancel()
+        state['pool'].shutdown()
+
+    app = FastAPI(title="Toxicity Classifier", lifespan=lifespan)
+    app.add_middleware(BodySizeLimit, max_body_bytes=config.max_body_bytes)
+
+    def route_template(request):
+        # Metrics are labelled by route, not by raw path, so arbitrary URLs cannot create new series
+        for route in app.routes:
+            match, _ = route.matches(request.scope)
+            if match != Match.NONE:
+                return route.path
+        return 'unmatched'
+
+    @app.middleware('http')
+    async def record_request(request, call_next):
+        path = route_template(request)
+        # Streamed responses are timed until their headers are sent. Other requests run on the event loop
+        # meanwhile, so only wall-clock time is recorded
+        with span('service.request', cpu=False, path=path):
+            response = await call_next(request)
+        increment('service_responses', path=path, status=response.status_code)
+        return response
+
+    def resolve_model(model_choice):
+        # Only preloaded models are served, workers never load another model on demand
+        model_choice = model_choice or config.models[0]
+        if model_choice not in config.models:
+            raise HTTPException(status_code=404, detail=f"Model '{model_choice}' is not served, available models: {config.models}")
+        return model_choice
+
+    def check_texts(texts):
+        if len(texts) > config.max_batch_items:
+            raise HTTPException(status_code=413, detail=f"At most {config.max_batch_items} texts per request")
+        if any(len(text) > config.max_text_chars for text in texts):
+            raise HTTPException(status_code=413, detail=f"Texts are limited to {config.max_text_chars} characters")
+
+    def admit():
+        """Reserve a slot in the bounded queue, rejecting the request when the service is saturated."""
+        if not state['ready']:
+            raise HTTPException(status_code=503, detail="Models are still loading", headers={'Retry-After': '5'})
+        if state['pending'] >= config.max_pending:
+            raise HTTPException(status_code=503, detail="Too many pending requests", headers={'Retry-After': '1'})
+        state['pending'] += 1
+
+    async def run(model_choice, texts):
+        loop = asyncio.get_running_loop()
+        pool = state['pool']
+        try:
+            probabilities, snapshot = await loop.run_in_executor(pool, _classify, model_choice, texts)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory), every later task would fail until the pool is replaced
+            if state['pool'] is pool:
+                print("A worker process died, restarting the worker pool")
+                pool.shutdown(wait=False)
+                start_pool()
+            raise HTTPException(status_code=503, detail="Workers are restarting", headers={'Retry-After': '5'})
+        metrics.merge(snapshot)
+        return probabilities
+
+    @app.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    @app.get('/ready')
+    async def ready():
+        if not state['ready']:
+            return JSONResponse({'status': 'loading'}, status_code=503)
+        return {'status': 'ready', 'models': config.models, 'workers': config.num_workers, 'pending': state['pending']}
+
+    @app.get('/metrics')
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.to_prometheus(), media_type='text/plain; version=0.0.4')
+
+    @app.get('/models')
+    async def models():
+        return {'models': config.models}
+
+    @app.post('/classify')
+    async def classify(body: ClassifyRequest):
+        model_choice = resolve_model(body.model)
+        check_texts([body.text])
+        admit()
+        try:
+            probability = (await run(model_choice, [body.text]))[0]
+        finally:
+            state['pending'] -= 1
+        return {'model': model_choice, 'label': inference.label_for(probability), 'probability': probability}
+
+    @app.post('/classify/batch')
+    async def classify_batch(request: Request, model: Optional[str] = None):
+        """Classify many texts, from a JSON body {"texts": [...]} or an NDJSON body of {"text": ...} lines.
+
+        With `Accept: application/x-ndjson` results are streamed one line per text as chunks finish.
+        """
+        # BodySizeLimit has already answered with a 413 if the body passed max_body_bytes
+        raw = await request.body()
+        try:
+            if request.headers.get('content-type', '').startswith(NDJSON):
+                texts = parse_ndjson(raw)
+            else:
+                body = BatchRequest.model_validate_json(raw)
+                texts, model = body.texts, body.model or model
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid request body: {e}")
+
+        model_choice = resolve_model(model)
+        check_texts(texts)
+        admit()
+        chunks = [texts[start:start + config.chunk_size] for start in range(0, len(texts), config.chunk_size)]
+
+        if NDJSON not in request.headers.get('accept', ''):
+            try:
+                probabilities = [p for chunk in await asyncio.gather(*(run(model_choice, chunk) for chunk in chunks)) for p in chunk]
+            finally:
+                state['pending'] -= 1
+            return {'model': model_choice, 'results': [_result(i, p) for i, p in enumerate(probabilities)]}
+
+        async def stream():
+            # All chunks are submitted at once so the workers stay busy, and streamed back in order
+            futures = [asyncio.ensure_future(run(model_choice, chunk)) for chunk in chunks]
+            try:
+                index = 0
+                for future in futures:
+                    for probability in await future:
+                        yield json.dumps({'model': model_choice, **_result(index, probability)}) + '\n'
+                        index += 1
+            finally:
+                for future in futures:
+                    future.cancel()
+                state['pending'] -= 1
+
+        return StreamingResponse(stream(), media_type=NDJSON)
+
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    defaults = ServiceConfig()
+    parser = argparse.ArgumentParser(description="HTTP inference service for the toxicity models.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--models', nargs='+', default=defaults.models, choices=[model[0] for model in inference.models_validation],
+                        help="models_validation names to preload, the first is the default")
+    parser.add_argument('--workers', type=int, default=defaults.num_workers, help="Worker processes, each holding every preloaded model")
+    parser.add_argument('--threads-per-worker', type=int, default=defaults.threads_per_worker, help="torch threads per worker, 0 keeps the default")
+    parser.add_argument('--max-pending', type=int, default=defaults.max_pending, help="Requests in progress before new ones get 503")
+    parser.add_argument('--max-batch-items', type=int, default=defaults.max_batch_items)
+    parser.add_argument('--max-text-chars', type=int, default=defaults.max_text_chars)
+    parser.add_argument('--max-body-bytes', type=int, default=defaults.max_body_bytes)
+    parser.add_argument('--chunk-size', type=int, default=defaults.chunk_size, help="Texts per worker task in batch requests")
+    args = parser.parse_args()
+
+    config = ServiceConfig(args.models, args.workers, args.threads_per_worker, args.max_pending, args.max_batch_items,
+                           args.max_text_chars, args.max_body_bytes, args.chunk_size)
+    uvicorn.run(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
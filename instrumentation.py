@@ -0,0 +1,273 @@
+"""Lightweight latency and resource instrumentation for the scraping, labelling and inference pipelines.
+
+Stages are timed with spans, e.g. `with span('scraper.is_maltese'):` or `@timed('inference.forward')`, which
+record wall-clock and CPU time into histograms. Counters track events such as comments kept or skipped. The
+metrics can be exported as Prometheus text or JSON. Only the standard library is imported, so this module is
+cheap to import from workers; torch.profiler is imported only when a profile capture is requested.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets in seconds, from sub-millisecond tokenization to page loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values, with count, sum, min and max."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the observations of another histogram with the same buckets, e.g. from a worker process."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket holding it."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {('+Inf' if bound == float('inf') else bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in items) + '}'
+
+
+class Registry:
+    """Holds the span histograms and counters of one process."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.cpu_times = {}
+        self.errors = {}
+        self.counters = {}
+        self.started = time.time()
+
+    @contextmanager
+    def span(self, name, cpu=True, **labels):
+        """Time the body of a with block, recording wall-clock and CPU seconds and counting exceptions.
+
+        Pass cpu=False for spans around awaits, where the thread's CPU time includes other interleaved tasks.
+        """
+        if not self.enabled:
+            yield
+            return
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        except BaseException:
+            self.increment('span_errors', span=name, **labels)
+            raise
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu_time = time.thread_time() - start_cpu
+            key = (name, _label_key(labels))
+            with self.lock:
+                self.durations.setdefault(key, Histogram()).observe(wall)
+                if cpu:
+                    self.cpu_times.setdefault(key, Histogram()).observe(cpu_time)
+
+    def timed(self, name=None, **labels):
+        """Decorator recording every call of a function as a span, named after the function by default."""
+        def decorator(function):
+            span_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.cpu_times.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def drain(self):
+        """Return the spans and counters recorded since the last drain and clear them, to send to another process."""
+        with self.lock:
+            snapshot = {'durations': self.durations, 'cpu_times': self.cpu_times, 'counters': self.counters}
+            self.durations, self.cpu_times, self.counters = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot from drain(), e.g. the inference spans of a worker process, to this registry."""
+        if not self.enabled or not snapshot:
+            return
+        with self.lock:
+            for attribute in ('durations', 'cpu_times'):
+                histograms = getattr(self, attribute)
+                for key, histogram in snapshot[attribute].items():
+                    if key in histograms:
+                        histograms[key].merge(histogram)
+                    else:
+                        histograms[key] = histogram
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def resources(self):
+        """Process-wide resource usage: CPU time, peak resident memory and uptime."""
+        usage = {'process_cpu_seconds': time.process_time(), 'uptime_seconds': time.time() - self.started}
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            usage['peak_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+        except ImportError:
+            pass
+        return usage
+
+    def to_dict(self):
+        with self.lock:
+            spans = [
+                {'span': name, 'labels': dict(labels), 'wall_seconds': self.durations[key].to_dict(),
+                 'cpu_seconds': self.cpu_times[key].to_dict() if key in self.cpu_times else None}
+                for key in self.durations for name, labels in [key]
+            ]
+            counters = [{'counter': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.counters.items()]
+        return {'spans': spans, 'counters': counters, 'resources': self.resources()}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for metric, histograms in (('span_duration_seconds', self.durations), ('span_cpu_seconds', self.cpu_times)):
+                if not histograms:
+                    continue
+                lines.append(f'# TYPE {metric} histogram')
+                for (name, labels), histogram in histograms.items():
+                    series = (('span', name),) + labels
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{metric}_bucket{_format_labels(series, {"le": le})} {cumulative}')
+                    lines.append(f'{metric}_sum{_format_labels(series)} {histogram.sum}')
+                    lines.append(f'{metric}_count{_format_labels(series)} {histogram.count}')
+            for counter_name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {counter_name}_total counter')
+                for (name, labels), value in self.counters.items():
+                    if name == counter_name:
+                        lines.append(f'{name}_total{_format_labels(labels)} {value}')
+        for name, value in self.resources().items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, as JSON for .json files and as Prometheus text otherwise."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json() if path.endswith('.json') else self.to_prometheus())
+
+    def report(self):
+        """Return a table of the spans sorted by total time, for printing at the end of a run."""
+        rows = [f"{'span':<40} {'count':>8} {'total s':>10} {'mean ms':>10} {'p95 ms':>10} {'cpu %':>7}"]
+        with self.lock:
+            items = sorted(self.durations.items(), key=lambda item: -item[1].sum)
+            for key, histogram in items:
+                name = key[0] + _format_labels(key[1])
+                cpu = self.cpu_times[key].sum / histogram.sum * 100 if histogram.sum and key in self.cpu_times else 0.0
+                rows.append(f"{name:<40} {histogram.count:>8} {histogram.sum:>10.2f} {histogram.sum / histogram.count * 1000:>10.2f} "
+                            f"{histogram.quantile(0.95) * 1000:>10.2f} {cpu:>7.1f}")
+            for (name, labels), value in sorted(self.counters.items()):
+                rows.append(f"{name + _format_labels(labels):<40} {value:>8}")
+        return '\n'.join(rows)
+
+
+# Process-wide registry used by the pipelines, disabled with TOXIC_METRICS=0
+metrics = Registry(enabled=os.environ.get('TOXIC_METRICS', '1') != '0')
+span = metrics.span
+timed = metrics.timed
+increment = metrics.increment
+
+
+@contextmanager
+def torch_profile(output_dir=None, record_shapes=False, row_limit=20):
+    """Capture a torch.profiler trace of the with block when output_dir (or TORCH_PROFILE_DIR) is set.
+
+    The Chrome trace is written to output_dir and the most expensive operators are printed. Without an output
+    directory this does nothing, so it can wrap inference or training code permanently.
+    """
+    output_dir = output_dir or os.environ.get('TORCH_PROFILE_DIR')
+    if not output_dir:
+        yield None
+        return
+
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+    with profile(activities=activities, record_shapes=record_shapes) as profiler:
+        yield profiler
+    os.makedirs(output_dir, exist_ok=True)
+    trace_path = os.path.join(output_dir, f'trace_{os.getpid()}_{int(time.time())}.json')
+    profiler.export_chrome_trace(trace_path)
+    sort_by = 'cuda_time_total' if torch.cuda.is_available() else 'cpu_time_total'
+    print(profiler.key_averages().table(sort_by=sort_by, row_limit=row_limit))
+    print(f"Profiler trace written to {trace_path}")
@@ -0,0 +1,102 @@
+"""Compact fastText-style student classifier distilled from a fine-tuned transformer teacher.
+
+A comment is represented by hashed word unigrams/bigrams and character n-grams of its words (Maltese subwords
+such as prefixes and the ħ/ż/ġ/għ spellings), averaged by an EmbeddingBag and scored by a linear layer. This
+runs thousands of comments per second on a single CPU core. See Training_Code/Training-Main/distillation.py.
+"""
+import os
+import re
+import json
+import zlib
+import torch
+import torch.nn as nn
+
+STUDENT_CONFIG = 'student_config.json'
+STUDENT_WEIGHTS = 'student.pt'
+
+
+class SubwordHasher:
+    """Maps a comment to hashed feature ids: words, word n-grams and character n-grams of <word>."""
+
+    def __init__(self, num_buckets=2 ** 18, min_char_ngram=3, max_char_ngram=5, word_ngrams=2):
+        self.num_buckets = num_buckets
+        self.min_char_ngram = min_char_ngram
+        self.max_char_ngram = max_char_ngram
+        self.word_ngrams = word_ngrams
+
+    def config(self):
+        return {'num_buckets': self.num_buckets, 'min_char_ngram': self.min_char_ngram,
+                'max_char_ngram': self.max_char_ngram, 'word_ngrams': self.word_ngrams}
+
+    def _bucket(self, feature):
+        # crc32 is stable across processes, unlike hash() of a str
+        return zlib.crc32(feature.encode('utf-8')) % self.num_buckets
+
+    def encode(self, text):
+        words = re.findall(r'\w+', str(text).lower())
+        features = [f'w:{word}' for word in words]
+        for n in range(2, self.word_ngrams + 1):
+            features.extend('w:' + ' '.join(words[i:i + n]) for i in range(len(words) - n + 1))
+        for word in words:
+            marked = f'<{word}>'
+            for n in range(self.min_char_ngram, self.max_char_ngram + 1):
+                features.extend('c:' + marked[i:i + n] for i in range(len(marked) - n + 1))
+        # Empty comments still need one feature for the EmbeddingBag
+        return [self._bucket(feature) for feature in features] or [self._bucket('<empty>')]
+
+    def batch(self, texts):
+        """Return (ids, offsets) tensors for an EmbeddingBag over a batch of texts."""
+        encoded = [self.encode(text) for text in texts]
+        offsets = [0]
+        for ids in encoded[:-1]:
+            offsets.append(offsets[-1] + len(ids))
+        ids = torch.tensor([i for text_ids in encoded for i in text_ids], dtype=torch.long)
+        return ids, torch.tensor(offsets, dtype=torch.long)
+
+
+class FastTextStudent(nn.Module):
+    """EmbeddingBag + linear toxicity classifier, outputting one logit per comment like the teacher models."""
+
+    is_student = True
+
+    def __init__(self, hasher, embedding_dim=64):
+        super().__init__()
+        self.hasher = hasher
+        self.embedding_dim = embedding_dim
+        self.embedding = nn.EmbeddingBag(hasher.num_buckets, embedding_dim, mode='mean', sparse=True)
+        self.classifier = nn.Linear(embedding_dim, 1)
+        nn.init.uniform_(self.embedding.weight, -1.0 / embedding_dim, 1.0 / embedding_dim)
+
+    def forward(self, ids, offsets):
+        return self.classifier(self.embedding(ids, offsets)).view(-1)
+
+    def predict_probabilities(self, texts, batch_size=256):
+        import numpy as np
+
+        self.eval()
+        probabilities = np.empty(len(texts), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                ids, offsets = self.hasher.batch(texts[start:start + batch_size])
+                probabilities[start:start + batch_size] = torch.sigmoid(self(ids, offsets)).numpy()
+        return probabilities
+
+    def save(self, path, **metadata):
+        os.makedirs(path, exist_ok=True)
+        torch.save(self.state_dict(), os.path.join(path, STUDENT_WEIGHTS))
+        config = {'hasher': self.hasher.config(), 'embedding_dim': self.embedding_dim}
+        config.update(metadata)
+        with open(os.path.join(path, STUDENT_CONFIG), 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2)
+
+    def num_parameters(self):
+        return sum(p.numel() for p in self.parameters())
+
+
+def load_student(path):
+    with open(os.path.join(path, STUDENT_CONFIG), encoding='utf-8') as f:
+        config = json.load(f)
+    model = FastTextStudent(SubwordHasher(**config['hasher']), config['embedding_dim'])
+    model.load_state_dict(torch.load(os.path.join(path, STUDENT_WEIGHTS), map_location='cpu'))
+    model.eval()
+    return model
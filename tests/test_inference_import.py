@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import inference
+
+# Generous enough for a cold CI runner, far below the seconds torch and transformers take to import
+IMPORT_BUDGET_SECONDS = 0.5
+
+
+def test_import_pulls_in_no_heavy_modules():
+    _, heavy = inference.measure_import()
+    assert heavy == [], f"import inference loaded {heavy}, they must be imported lazily"
+
+
+def test_import_is_within_budget():
+    elapsed, _ = inference.measure_import()
+    assert elapsed <= IMPORT_BUDGET_SECONDS, f"import inference took {elapsed:.3f}s, budget {IMPORT_BUDGET_SECONDS}s"